@@ -0,0 +1,67 @@
+import asyncio
+import contextvars
+import functools
+import threading
+
+# -----------------------
+# Running blocking work off the event loop
+# -----------------------
+# Async routes must never touch the disk, the vault or the model directly:
+# one slow write would stall every other request in the worker. Instead the
+# work goes to a dedicated, bounded executor (see services: io_executor for
+# file/DB I/O, model_executor for generation), which also keeps FastAPI's
+# default threadpool free for the remaining sync routes.
+
+
+async def run_in(executor, fn, *args, **kwargs):
+    """Await ``fn(*args, **kwargs)`` on ``executor``; contextvars (metrics spans) come along."""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+    return await loop.run_in_executor(executor, call)
+
+
+_DONE = object()
+_cancel = contextvars.ContextVar("hope_vault_stream_cancel", default=None)
+
+
+def cancel_event():
+    """threading.Event set once the consumer of the current iterate_in stream is gone (None outside one).
+
+    Blocking producers check it to stop work nobody will read, e.g. a model
+    generation whose client disconnected.
+    """
+    return _cancel.get()
+
+
+async def iterate_in(executor, iterator):
+    """Async-iterate a blocking iterator, pulling each item on ``executor``."""
+    loop = asyncio.get_running_loop()
+    cancel = threading.Event()
+    # one context for every pull, so the iterator sees cancel_event() (and the request's metrics spans)
+    ctx = contextvars.copy_context()
+    ctx.run(_cancel.set, cancel)
+    try:
+        while True:
+            item = await loop.run_in_executor(executor, ctx.run, next, iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        cancel.set()
+
+
+class AsyncProxy:
+    """Awaitable view of an object: ``await proxy.method(...)`` runs ``obj.method`` on ``executor``."""
+
+    def __init__(self, obj, executor):
+        self._obj = obj
+        self._executor = executor
+
+    def __getattr__(self, name):
+        method = getattr(self._obj, name)
+
+        async def call(*args, **kwargs):
+            return await run_in(self._executor, method, *args, **kwargs)
+
+        call.__name__ = name
+        return call
@@ -0,0 +1,92 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# -----------------------
+# Dynamic request batching for the text-generation pipeline
+# -----------------------
+# Concurrent story requests are collected for up to ``max_wait`` seconds (or
+# until ``max_batch`` prompts are waiting) and run as one batched generate call,
+# instead of each request doing its own forward pass and fighting for the CPU.
+
+
+class _Request:
+    def __init__(self, prompt: str, kwargs: dict):
+        self.prompt = prompt
+        self.kwargs = kwargs
+        self.future = Future()
+
+    def key(self):
+        # only requests with identical generation params can share a batch
+        return tuple(sorted(self.kwargs.items()))
+
+
+class GenerationBatcher:
+    def __init__(self, generator, max_batch: int = 8, max_wait: float = 0.01):
+        self.generator = generator
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._prepare_tokenizer()
+        self._worker = threading.Thread(target=self._run, name="generation-batcher", daemon=True)
+        self._worker.start()
+
+    def _prepare_tokenizer(self):
+        tokenizer = getattr(self.generator, "tokenizer", None)
+        if tokenizer is None:
+            return
+        # decoder-only models must be padded on the left so every prompt ends
+        # right where generation starts
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+
+    def generate(self, prompt: str, **kwargs):
+        """Blocking call with the same return shape as ``generator(prompt, **kwargs)``."""
+        return self.submit(prompt, **kwargs).result()
+
+    def submit(self, prompt: str, **kwargs) -> Future:
+        req = _Request(prompt, kwargs)
+        self._queue.put(req)
+        return req.future
+
+    def _collect(self):
+        first = self._queue.get()
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            groups = {}
+            for req in batch:
+                groups.setdefault(req.key(), []).append(req)
+            for reqs in groups.values():
+                self._run_group(reqs)
+
+    def _run_group(self, reqs):
+        reqs = [r for r in reqs if r.future.set_running_or_notify_cancel()]
+        if not reqs:
+            return
+        prompts = [r.prompt for r in reqs]
+        try:
+            if len(prompts) == 1:
+                outputs = [self.generator(prompts[0], **reqs[0].kwargs)]
+            else:
+                outputs = self.generator(prompts, batch_size=len(prompts), **reqs[0].kwargs)
+        except Exception as e:
+            for r in reqs:
+                r.future.set_exception(e)
+            return
+        for r, out in zip(reqs, outputs):
+            r.future.set_result(out)
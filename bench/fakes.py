@@ -0,0 +1,100 @@
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from gtts import gTTS
+
+# -----------------------
+# Local stand-ins for external services
+# -----------------------
+# FakeLibreTranslate speaks enough of the LibreTranslate /translate API for
+# translate_text; StubGTTS replaces gtts.gTTS. Both sleep for a configurable
+# latency so benchmarks don't depend on the network but still see realistic
+# upstream waits.
+
+# a few silent MPEG-1 Layer III frames, enough for players to accept the file
+_SILENT_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+
+class FakeLibreTranslate:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.05, fail_every: int = 0):
+        self.latency = latency
+        self.fail_every = fail_every  # every Nth request answers 503 (0 = never)
+        self.requests = 0
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = parse_qs(self.rfile.read(length).decode("utf-8"))
+                with fake._lock:
+                    fake.requests += 1
+                    n = fake.requests
+                time.sleep(fake.latency)
+                if fake.fail_every and n % fake.fail_every == 0:
+                    self._reply(503, {"error": "fake upstream failure"})
+                    return
+                text = form.get("q", [""])[0]
+                target = form.get("target", ["en"])[0]
+                self._reply(200, {"translatedText": f"[{target}] {text}"})
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/translate"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-libretranslate", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StubGTTS:
+    """Drop-in for gtts.gTTS: writes silent mp3 frames after gTTS-like delays.
+
+    Text is split the way gTTS splits it (one request per sentence or clause
+    once it exceeds 100 characters), and each "request" costs ``latency``
+    (+ per-char cost) in sequence; ``calls`` counts requests.
+    """
+
+    latency = 0.2
+    per_char = 0.0005
+    calls = 0
+
+    def __init__(self, text: str, lang: str = "en", slow: bool = False, **kwargs):
+        self.text = text
+        self.lang = lang
+        self.slow = slow
+
+    def write_to_fp(self, fp):
+        parts = len(gTTS(self.text)._tokenize(self.text)) or 1
+        type(self).calls += parts
+        time.sleep(parts * self.latency + self.per_char * len(self.text))
+        fp.write(_SILENT_FRAME * max(1, len(self.text) // 20))
+
+    def save(self, path):
+        buf = io.BytesIO()
+        self.write_to_fp(buf)
+        with open(path, "wb") as f:
+            f.write(buf.getvalue())
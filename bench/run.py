@@ -0,0 +1,592 @@
+"""Reproducible load scenarios against the /api/* routes.
+
+Runs the real app (uvicorn, in-process) in a scratch directory with a seeded
+synthetic vault, a local fake LibreTranslate and a stubbed gTTS, then reports
+throughput and p50/p95/p99 latency per scenario as JSON.
+
+    python -m bench.run                                   # every scenario
+    python -m bench.run --scenarios vault,translate --users 50 --entries 500
+    python -m bench.run --compare bench/results/baseline.json
+
+Story generation uses whatever model HOPE_VAULT_MODEL points at; pass
+--skip-model to leave the generate_story scenarios out.
+
+Streaming scenarios (generate_story_stream, story_pipeline,
+text_to_speech_stream) also report ttft_p50/p95/p99_ms: time to the first
+`token` event, or to the first audio bytes for speech. The jobs scenario
+times a submit to /api/jobs/* through polling until its result is fetched.
+
+translate_fresh sends text that was never translated before, so every request
+reaches LibreTranslate; with --translate-fail-every and --translate-fallbacks
+it shows how the circuit breaker and hedged fallbacks hold up when the
+primary misbehaves (breaker state ends up in the report).
+
+prompt_under_load first checks that /api/prompt still answers, within
+--blocked-prompt-budget, while every io_executor and model_executor thread is
+deliberately held; a route that blocks the event loop or waits on those pools
+fails the run. It then reports /api/prompt idle and again while other threads
+saturate the app with writes, uploads and generations. Those clients share
+the app's interpreter, so the slowdown includes GIL contention and only fails
+the run when --max-prompt-slowdown is given.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from bench.fakes import FakeLibreTranslate, StubGTTS  # noqa: E402
+
+WORDS = (
+    "hope light walk park friend mother smile rain morning tea garden music laugh school "
+    "river sunset patience courage kindness letter train city home book quiet warm"
+).split()
+
+
+# -----------------------
+# Synthetic data
+# -----------------------
+def _sentence(rng, n_words=10):
+    words = [rng.choice(WORDS) for _ in range(n_words)]
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraphs(rng, n_paragraphs=3, sentences=4):
+    return "\n\n".join(" ".join(_sentence(rng) for _ in range(sentences)) for _ in range(n_paragraphs))
+
+
+def seed_vault(store, users: int, entries: int, seed: int):
+    """Write users x entries memories (plus a couple of stories each) straight into the store."""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    for u in range(users):
+        user_id = f"user-{u}"
+        batch = []
+        for e in range(entries):
+            batch.append({
+                "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "text": _sentence(rng, rng.randint(6, 20)),
+                "language": "en",
+                "timestamp": (start + timedelta(minutes=e * 37 + u)).isoformat(),
+            })
+        store.append_many(user_id, "entries", batch)
+        stories = [{
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "text": _paragraphs(rng),
+            "theme": "hope",
+            "language": "en",
+            "timestamp": (start + timedelta(days=400, minutes=s)).isoformat(),
+        } for s in range(2)]
+        store.append_many(user_id, "stories", stories)
+
+
+# -----------------------
+# Scenarios: (session, base_url, rng, ctx) -> response
+# -----------------------
+def _user(rng, ctx):
+    return f"user-{rng.randrange(ctx['users'])}"
+
+
+def sc_prompt(session, base, rng, ctx):
+    return session.get(f"{base}/api/prompt", params={"lang": rng.choice(["en", "hi", "bn", "ta"])})
+
+
+def sc_add_entry(session, base, rng, ctx):
+    return session.post(f"{base}/api/entry", json={"user_id": _user(rng, ctx), "text": _sentence(rng), "language": "en"})
+
+
+def sc_vault(session, base, rng, ctx):
+    return session.get(f"{base}/api/vault", params={"user_id": _user(rng, ctx)})
+
+
+def sc_vault_page(session, base, rng, ctx):
+    return session.get(f"{base}/api/vault", params={"user_id": _user(rng, ctx), "limit": 20})
+
+
+def sc_search(session, base, rng, ctx):
+    return session.get(f"{base}/api/search", params={"user_id": _user(rng, ctx), "q": " ".join(rng.sample(WORDS, 2)), "limit": 10})
+
+
+def _read_events(session, url, payload, stop_at):
+    """POST to an SSE route and read events until one in ``stop_at``.
+
+    Sets ``resp.ttft`` (seconds to the first `token` event) and
+    ``resp.stream_error`` (an `error` event arrived).
+    """
+    t0 = time.perf_counter()
+    resp = session.post(url, json=payload, stream=True)
+    resp.ttft = None
+    resp.stream_error = False
+    if resp.headers.get("content-type", "").startswith("text/event-stream"):
+        for line in resp.iter_lines(decode_unicode=True):
+            if not line.startswith("event: "):
+                continue
+            event = line[len("event: "):]
+            if event == "token" and resp.ttft is None:
+                resp.ttft = time.perf_counter() - t0
+            elif event == "error":
+                resp.stream_error = True
+            if event in stop_at or event == "error":
+                break
+        resp.close()
+    return resp
+
+
+def sc_generate_story(session, base, rng, ctx):
+    return session.post(f"{base}/api/generate_story", json={"user_id": _user(rng, ctx), "theme": "hope", "max_length": 64})
+
+
+def sc_generate_story_stream(session, base, rng, ctx):
+    payload = {"user_id": _user(rng, ctx), "theme": "hope", "max_length": 64}
+    return _read_events(session, f"{base}/api/generate_story/stream", payload, stop_at={"done"})
+
+
+def sc_story_chain(session, base, rng, ctx):
+    """Time to audio the old way: generate, then translate, then synthesize."""
+    story = session.post(f"{base}/api/generate_story", json={"user_id": _user(rng, ctx), "theme": "hope", "max_length": 64}).json()
+    text = (story.get("story") or {}).get("text") or "."
+    translated = session.post(f"{base}/api/translate", json={"text": text, "target_lang": "hi"}).json()
+    return session.post(f"{base}/api/text_to_speech", json={"text": translated.get("translatedText") or text, "language": "hi"})
+
+
+def sc_story_pipeline(session, base, rng, ctx):
+    """Time to first audio through the pipeline: stops reading at the first voiced segment."""
+    payload = {"user_id": _user(rng, ctx), "theme": "hope", "max_length": 64, "target_lang": "hi"}
+    return _read_events(session, f"{base}/api/story_pipeline/stream", payload, stop_at={"segment", "done"})
+
+
+def sc_translate(session, base, rng, ctx):
+    # a small pool of stories, so repeated translations behave like real traffic
+    return session.post(f"{base}/api/translate", json={"text": rng.choice(ctx["texts"]), "target_lang": rng.choice(["hi", "bn", "ta"])})
+
+
+def sc_translate_fresh(session, base, rng, ctx):
+    # never-seen text: every segment misses the caches and goes upstream
+    text = f"{rng.choice(ctx['texts'])[:200]} {uuid.uuid4().hex}"
+    return session.post(f"{base}/api/translate", json={"text": text, "target_lang": "hi"})
+
+
+def sc_text_to_speech(session, base, rng, ctx):
+    return session.post(f"{base}/api/text_to_speech", json={"text": rng.choice(ctx["texts"]), "language": "en"})
+
+
+def sc_text_to_speech_stream(session, base, rng, ctx):
+    t0 = time.perf_counter()
+    resp = session.post(
+        f"{base}/api/text_to_speech/stream", json={"text": rng.choice(ctx["texts"]), "language": "en"}, stream=True
+    )
+    resp.ttft = None
+    if resp.headers.get("content-type", "").startswith("audio/"):
+        for chunk in resp.iter_content(chunk_size=None):
+            if chunk and resp.ttft is None:
+                resp.ttft = time.perf_counter() - t0
+    return resp
+
+
+def sc_jobs(session, base, rng, ctx):
+    """Submit a translate or speech job, poll it to completion, fetch the result."""
+    if rng.random() < 0.5:
+        kind, payload = "translate", {"text": rng.choice(ctx["texts"]), "target_lang": rng.choice(["hi", "bn", "ta"])}
+    else:
+        kind, payload = "text_to_speech", {"text": rng.choice(ctx["texts"]), "language": "en"}
+    resp = session.post(f"{base}/api/jobs/{kind}", json=payload)
+    if resp.status_code != 202:
+        return resp
+    job_id = resp.json()["job_id"]
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        status = session.get(f"{base}/api/jobs/{job_id}").json().get("status")
+        if status not in ("queued", "running"):
+            break
+        time.sleep(0.02)
+    return session.get(f"{base}/api/jobs/{job_id}/result")
+
+
+def sc_upload(session, base, rng, ctx):
+    blob = rng.randbytes(64 * 1024) if rng.random() < 0.7 else ctx["shared_blob"]
+    return session.post(f"{base}/api/upload", data={"user_id": _user(rng, ctx)}, files={"file": ("photo.jpg", blob, "image/jpeg")})
+
+
+SCENARIOS = {
+    "prompt": sc_prompt,
+    "add_entry": sc_add_entry,
+    "vault": sc_vault,
+    "vault_page": sc_vault_page,
+    "search": sc_search,
+    "generate_story": sc_generate_story,
+    "generate_story_stream": sc_generate_story_stream,
+    "story_chain": sc_story_chain,
+    "story_pipeline": sc_story_pipeline,
+    "translate": sc_translate,
+    "translate_fresh": sc_translate_fresh,
+    "text_to_speech": sc_text_to_speech,
+    "text_to_speech_stream": sc_text_to_speech_stream,
+    "jobs": sc_jobs,
+    "upload": sc_upload,
+    "prompt_under_load": sc_prompt,
+}
+MODEL_SCENARIOS = {"generate_story", "generate_story_stream", "story_chain", "story_pipeline"}
+UNDER_LOAD_SCENARIOS = {"prompt_under_load"}
+
+
+# -----------------------
+# Runner
+# -----------------------
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # nearest-rank: the smallest value with at least pct% of the samples at or below it
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def summarize(latencies, errors, seconds, concurrency, ttfts=()):
+    ordered = sorted(latencies)
+    ms = lambda v: round(v * 1000, 2) if v is not None else None  # noqa: E731
+    summary = {
+        "requests": len(latencies),
+        "errors": errors,
+        "concurrency": concurrency,
+        "seconds": round(seconds, 3),
+        "throughput_rps": round(len(latencies) / seconds, 2) if seconds else None,
+        "mean_ms": ms(statistics.fmean(ordered)) if ordered else None,
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "max_ms": ms(ordered[-1]) if ordered else None,
+    }
+    if ttfts:
+        ttfts = sorted(ttfts)
+        summary.update({f"ttft_p{p}_ms": ms(percentile(ttfts, p)) for p in (50, 95, 99)})
+    return summary
+
+
+def run_scenario(fn, base, requests_total, concurrency, seed, ctx):
+    import requests
+
+    from outbound import pooled_session
+
+    local = threading.local()
+    latencies = []
+    ttfts = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def one(i):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = pooled_session(4)
+        rng = random.Random(seed * 1_000_003 + i)
+        t0 = time.perf_counter()
+        ttft = None
+        try:
+            resp = fn(session, base, rng, ctx)
+            ttft = getattr(resp, "ttft", None)
+            ok = (
+                resp.status_code < 400
+                and not getattr(resp, "stream_error", False)
+                and "error" not in (resp.json() if resp.headers.get("content-type", "").startswith("application/json") else {})
+            )
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - t0
+        with lock:
+            latencies.append(elapsed)
+            if ttft is not None:
+                ttfts.append(ttft)
+            if not ok:
+                errors[0] += 1
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests_total)))
+    return summarize(latencies, errors[0], time.perf_counter() - t0, concurrency, ttfts)
+
+
+def run_under_load(fn, base, requests_total, concurrency, seed, ctx):
+    """run_scenario while ``ctx["load"]`` scenarios hammer the app from ``ctx["load_concurrency"]`` threads."""
+    import requests
+
+    from outbound import pooled_session
+
+    stop = threading.Event()
+    sent = [0]
+
+    def hammer(i):
+        session = pooled_session(4)
+        rng = random.Random(seed * 7919 + i)
+        while not stop.is_set():
+            try:
+                rng.choice(ctx["load"])(session, base, rng, ctx)
+            except requests.RequestException:
+                pass
+            sent[0] += 1
+
+    threads = [threading.Thread(target=hammer, args=(i,), daemon=True) for i in range(ctx["load_concurrency"])]
+    for t in threads:
+        t.start()
+    time.sleep(1.0)  # let the load build up first
+    try:
+        result = run_scenario(fn, base, requests_total, concurrency, seed, ctx)
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+    result["load_requests"] = sent[0]
+    return result
+
+
+def check_prompt_while_blocked(base, budget_s, requests_total=20):
+    """Hold every io_executor/model_executor thread and time /api/prompt meanwhile.
+
+    Deterministic stand-in for "the event loop stays responsive under load": a
+    prompt request that needs either pool, or an event loop stuck behind one,
+    misses ``budget_s``.
+    """
+    import requests
+
+    import services
+
+    pools = [services.io_executor, services.model_executor]
+    n_threads = sum(p._max_workers for p in pools)
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def hold():
+        started.release()
+        release.wait()
+
+    futures = [p.submit(hold) for p in pools for _ in range(p._max_workers)]
+    for _ in range(n_threads):
+        started.acquire()
+    latencies = []
+    errors = 0
+    try:
+        with requests.Session() as session:
+            for i in range(requests_total):
+                t0 = time.perf_counter()
+                try:
+                    ok = session.get(f"{base}/api/prompt", params={"lang": "en"}, timeout=budget_s).status_code < 400
+                except requests.RequestException:
+                    ok = False
+                latencies.append(time.perf_counter() - t0)
+                errors += not ok
+    finally:
+        release.set()
+        for f in futures:
+            f.result()
+    result = summarize(latencies, errors, sum(latencies), 1)
+    result["held_threads"] = n_threads
+    result["ok"] = errors == 0 and max(latencies) <= budget_s
+    return result
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_app(port):
+    import uvicorn
+
+    import main
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="bench-uvicorn", daemon=True).start()
+    deadline = time.monotonic() + 30
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("app did not start")
+        time.sleep(0.05)
+    return server
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(current: dict, baseline: dict, threshold: float):
+    """Print per-scenario deltas; return the scenarios that regressed beyond ``threshold``."""
+    regressions = []
+    print(f"{'scenario':<22}{'rps':>10}{'Δrps':>9}{'p95 ms':>10}{'Δp95':>9}{'p99 ms':>10}{'Δp99':>9}")
+    for name, cur in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+
+        def delta(key):
+            if not base.get(key) or cur.get(key) is None:
+                return None
+            return (cur[key] - base[key]) / base[key]
+
+        d_rps, d_p95, d_p99 = delta("throughput_rps"), delta("p95_ms"), delta("p99_ms")
+        fmt = lambda d: f"{d:+.1%}" if d is not None else "n/a"  # noqa: E731
+        print(f"{name:<22}{cur['throughput_rps']:>10}{fmt(d_rps):>9}{cur['p95_ms']:>10}{fmt(d_p95):>9}{cur['p99_ms']:>10}{fmt(d_p99):>9}")
+        if (d_rps is not None and d_rps < -threshold) or (d_p95 is not None and d_p95 > threshold):
+            regressions.append(name)
+    return regressions
+
+
+def main_cli(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of: " + ", ".join(SCENARIOS))
+    ap.add_argument("--users", type=int, default=20)
+    ap.add_argument("--entries", type=int, default=100, help="memories per seeded user")
+    ap.add_argument("--requests", type=int, default=200, help="requests per scenario (model scenarios run a tenth)")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--store", default=os.getenv("HOPE_VAULT_STORE", "cached"), help="vault backend to benchmark")
+    ap.add_argument("--translate-latency", type=float, default=0.05, help="fake LibreTranslate latency (s)")
+    ap.add_argument("--tts-latency", type=float, default=0.2, help="stub gTTS latency (s)")
+    ap.add_argument("--translate-fail-every", type=int, default=0, help="primary fake LibreTranslate answers 503 every Nth request")
+    ap.add_argument("--translate-fallbacks", type=int, default=0, help="extra fake LibreTranslate servers used as fallback URLs")
+    ap.add_argument("--skip-model", action="store_true", help="leave out scenarios that need the story model")
+    ap.add_argument("--load-concurrency", type=int, default=32, help="background clients for prompt_under_load")
+    ap.add_argument("--blocked-prompt-budget", type=float, default=0.5,
+                    help="seconds /api/prompt may take while the io/model executors are held (prompt_under_load)")
+    ap.add_argument("--max-prompt-slowdown", type=float, default=None,
+                    help="also fail if prompt_under_load p95 exceeds this multiple of the idle p95 (plus 20 ms slack)")
+    ap.add_argument("--out", help="where to write the JSON report (default bench/results/<timestamp>.json)")
+    ap.add_argument("--compare", help="baseline report to compare against")
+    ap.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    args = ap.parse_args(argv)
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        ap.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.skip_model:
+        names = [n for n in names if n not in MODEL_SCENARIOS]
+    out = args.out or os.path.join(REPO_ROOT, "bench", "results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    out = os.path.abspath(out)
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+
+    # everything the app writes (vault, caches, audio, uploads) goes to a scratch dir
+    workdir = tempfile.mkdtemp(prefix="hope-vault-bench-")
+    os.chdir(workdir)
+    fake_lt = FakeLibreTranslate(latency=args.translate_latency, fail_every=args.translate_fail_every).start()
+    fallbacks = [FakeLibreTranslate(latency=args.translate_latency).start() for _ in range(args.translate_fallbacks)]
+    os.environ["HOPE_VAULT_LIBRETRANSLATE_URL"] = fake_lt.url
+    os.environ["HOPE_VAULT_LIBRETRANSLATE_FALLBACK_URLS"] = ",".join(f.url for f in fallbacks)
+    os.environ["HOPE_VAULT_STORE"] = args.store
+    StubGTTS.latency = args.tts_latency
+
+    import services
+
+    services.gTTS = StubGTTS
+    t0 = time.perf_counter()
+    seed_vault(services.store, args.users, args.entries, args.seed)
+    services.backfill_search_index()
+    services.search_index.fresh = False  # already done; don't let startup repeat it
+    seed_seconds = time.perf_counter() - t0
+
+    port = _free_port()
+    server = _start_app(port)
+    base = f"http://127.0.0.1:{port}"
+    load_with_model = not args.skip_model and any(n in UNDER_LOAD_SCENARIOS for n in names)
+    if load_with_model or any(n in MODEL_SCENARIOS for n in names):
+        print("waiting for the story model ...")
+        services.model.wait_ready(timeout=600)
+
+    rng = random.Random(args.seed)
+    ctx = {
+        "users": args.users,
+        "texts": [_paragraphs(rng) for _ in range(10)],
+        "shared_blob": rng.randbytes(64 * 1024),
+        "load": [sc_add_entry, sc_upload, sc_vault] + ([sc_generate_story] if load_with_model else []),
+        "load_concurrency": args.load_concurrency,
+    }
+    results = {}
+    too_slow = []
+    for name in names:
+        total = max(5, args.requests // 10) if name in MODEL_SCENARIOS else args.requests
+        if name in UNDER_LOAD_SCENARIOS:
+            blocked = check_prompt_while_blocked(base, args.blocked_prompt_budget)
+            idle = run_scenario(SCENARIOS[name], base, total, args.concurrency, args.seed, ctx)
+            r = run_under_load(SCENARIOS[name], base, total, args.concurrency, args.seed, ctx)
+            r["executors_blocked"] = blocked
+            r["idle_p95_ms"] = idle["p95_ms"]
+            r["p95_slowdown"] = round(r["p95_ms"] / idle["p95_ms"], 2) if idle["p95_ms"] else None
+            if not blocked["ok"] or (
+                args.max_prompt_slowdown is not None and r["p95_ms"] > args.max_prompt_slowdown * idle["p95_ms"] + 20
+            ):
+                too_slow.append(name)
+        else:
+            r = run_scenario(SCENARIOS[name], base, total, args.concurrency, args.seed, ctx)
+        results[name] = r
+        print(f"{name:<22} {r['throughput_rps']:>8} req/s  p50 {r['p50_ms']} ms  p95 {r['p95_ms']} ms  p99 {r['p99_ms']} ms  errors {r['errors']}")
+        if r.get("ttft_p50_ms") is not None:
+            print(f"{'':<22} ttft p50 {r['ttft_p50_ms']} ms  p95 {r['ttft_p95_ms']} ms  p99 {r['ttft_p99_ms']} ms")
+        if name in UNDER_LOAD_SCENARIOS:
+            b = r["executors_blocked"]
+            print(f"{'':<22} executors held: max {b['max_ms']} ms  errors {b['errors']}  ({'ok' if b['ok'] else 'STALLED'})")
+            print(f"{'':<22} idle p95 {r['idle_p95_ms']} ms  slowdown x{r['p95_slowdown']}  background requests {r['load_requests']}")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "store": args.store,
+            "users": args.users,
+            "entries": args.entries,
+            "seed": args.seed,
+            "concurrency": args.concurrency,
+            "translate_latency": args.translate_latency,
+            "tts_latency": args.tts_latency,
+            "seed_seconds": round(seed_seconds, 3),
+            "model": services.model.status() if load_with_model or any(n in MODEL_SCENARIOS for n in names) else None,
+            "translate_fail_every": args.translate_fail_every,
+            "fake_libretranslate_requests": fake_lt.requests,
+            "fallback_libretranslate_requests": [f.requests for f in fallbacks],
+            "upstreams": services.upstream_status(),
+            "stub_gtts_calls": StubGTTS.calls,
+            "load_concurrency": args.load_concurrency,
+        },
+        "scenarios": results,
+    }
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print("report written to", out)
+
+    server.should_exit = True
+    fake_lt.stop()
+    for f in fallbacks:
+        f.stop()
+    if too_slow:
+        print("event loop stalled under load:", ", ".join(too_slow))
+        return 1
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print("regressions:", ", ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from storage import wal_connection
+
+# -----------------------
+# Size-bounded caches
+# -----------------------
+# MemoryLRU is the per-process tier; DiskCache is a SQLite file shared by all
+# workers on the box. Both evict least-recently-used values once the total
+# size of stored values exceeds their byte budget.
+
+
+def _size(value):
+    return len(value.encode("utf-8")) if isinstance(value, str) else len(value)
+
+
+class MemoryLRU:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = _size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= _size(old)
+            self._data[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= _size(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {"items": len(self._data), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+class DiskCache:
+    """Shared SQLite cache. The byte total is kept up to date by triggers (no
+    SUM over the table per write); hits only record their access time in
+    memory, written back in batches; eviction runs down to a low-water mark
+    so it happens once per many writes rather than on each one.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS cache (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        accessed REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache (accessed);
+    CREATE TABLE IF NOT EXISTS meta (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO meta (name, value) SELECT 'bytes', COALESCE(SUM(size), 0) FROM cache;
+    CREATE TRIGGER IF NOT EXISTS cache_bytes_insert AFTER INSERT ON cache
+        BEGIN UPDATE meta SET value = value + new.size WHERE name = 'bytes'; END;
+    CREATE TRIGGER IF NOT EXISTS cache_bytes_update AFTER UPDATE OF size ON cache
+        BEGIN UPDATE meta SET value = value + new.size - old.size WHERE name = 'bytes'; END;
+    CREATE TRIGGER IF NOT EXISTS cache_bytes_delete AFTER DELETE ON cache
+        BEGIN UPDATE meta SET value = value - old.size WHERE name = 'bytes'; END;
+    """
+
+    LOW_WATER = 0.9  # evict down to this fraction of max_bytes
+    TOUCH_BATCH = 256  # pending access times written back together
+    TOUCH_INTERVAL = 30.0  # ... or after this many seconds
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._touched = {}  # key -> last access time not yet written
+        self._touched_at = time.monotonic()
+        self._touch_lock = threading.Lock()
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+
+    def _conn(self):
+        return wal_connection(self._local, self.path)
+
+    def get(self, key):
+        row = self._conn().execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with self._touch_lock:
+            self._touched[key] = time.time()
+            due = len(self._touched) >= self.TOUCH_BATCH or time.monotonic() - self._touched_at >= self.TOUCH_INTERVAL
+        if due:
+            self._write_touches()
+        return row[0]
+
+    def _write_touches(self):
+        with self._touch_lock:
+            touched, self._touched = self._touched, {}
+            self._touched_at = time.monotonic()
+        if touched:
+            conn = self._conn()
+            with conn:
+                conn.executemany("UPDATE cache SET accessed = ? WHERE key = ?", [(t, k) for k, t in touched.items()])
+
+    def set(self, key, value):
+        size = _size(value)
+        if size > self.max_bytes:
+            return
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO cache (key, value, size, accessed) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size, accessed = excluded.accessed",
+                (key, value, size, time.time()),
+            )
+            (total,) = conn.execute("SELECT value FROM meta WHERE name = 'bytes'").fetchone()
+        if total > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        self._write_touches()  # recent hits must not look cold
+        conn = self._conn()
+        with conn:
+            # another worker may have evicted in the meantime
+            (total,) = conn.execute("SELECT value FROM meta WHERE name = 'bytes'").fetchone()
+            excess = total - int(self.max_bytes * self.LOW_WATER)
+            doomed = []
+            for key, size in conn.execute("SELECT key, size FROM cache ORDER BY accessed"):
+                if excess <= 0:
+                    break
+                doomed.append((key,))
+                excess -= size
+            conn.executemany("DELETE FROM cache WHERE key = ?", doomed)
+
+    def stats(self):
+        conn = self._conn()
+        (items,) = conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        (total,) = conn.execute("SELECT value FROM meta WHERE name = 'bytes'").fetchone()
+        return {"items": items, "bytes": total, "max_bytes": self.max_bytes, "path": os.path.abspath(self.path)}
@@ -0,0 +1,170 @@
+import json
+import os
+import sys
+import time
+
+# -----------------------
+# Generation engines (CPU)
+# -----------------------
+# "fp32" is the stock transformers pipeline. "int8" applies torch dynamic
+# quantization: Linear weights are stored as int8 and activations are
+# quantized on the fly, which cuts resident memory and speeds up the matmuls
+# on CPU. GPT-2 style models use transformers' Conv1D (a transposed Linear)
+# for attention/MLP projections, so those are converted to nn.Linear first,
+# otherwise only the LM head would be quantized.
+#
+# Compare engines on a box with:  python engines.py compare [model_name]
+
+
+def configure_threads(intra_op: int = 0, inter_op: int = 0):
+    """Pin torch's thread pools for this worker (0 keeps torch's default)."""
+    import torch
+
+    if intra_op > 0:
+        torch.set_num_threads(intra_op)
+    if inter_op > 0:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError:
+            # can only be set before the first inter-op parallel work starts
+            print("Warning: inter-op threads already initialized, keeping", torch.get_num_interop_threads())
+
+
+def _conv1d_to_linear(module):
+    import torch
+    from transformers.pytorch_utils import Conv1D
+
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            in_features, out_features = child.weight.shape
+            linear = torch.nn.Linear(in_features, out_features)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            _conv1d_to_linear(child)
+    return module
+
+
+def load_fp32(model_name: str):
+    from transformers import pipeline
+
+    return pipeline("text-generation", model=model_name)
+
+
+def load_int8(model_name: str):
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    lm = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32)
+    lm.eval()
+    lm = torch.ao.quantization.quantize_dynamic(_conv1d_to_linear(lm), {torch.nn.Linear}, dtype=torch.qint8)
+    return pipeline("text-generation", model=lm, tokenizer=tokenizer)
+
+
+ENGINES = {
+    "fp32": load_fp32,
+    "int8": load_int8,
+}
+
+
+def load_pipeline(engine: str, model_name: str):
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown generation engine {engine!r}; choose one of {sorted(ENGINES)}")
+    return ENGINES[engine](model_name)
+
+
+# -----------------------
+# Engine comparison
+# -----------------------
+def _rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource  # not available on Windows
+
+    # peak RSS; kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _sanity(text: str):
+    words = text.split()
+    printable = sum(ch.isprintable() or ch.isspace() for ch in text) / max(1, len(text))
+    distinct = len(set(words)) / max(1, len(words))
+    return {
+        "chars": len(text),
+        "printable_ratio": round(printable, 3),
+        "distinct_word_ratio": round(distinct, 3),
+        "ok": bool(words) and printable > 0.95 and distinct > 0.3,
+    }
+
+
+def benchmark(engine: str, model_name: str, prompt: str, max_new_tokens: int = 64, runs: int = 3,
+              intra_op: int = 0, inter_op: int = 0):
+    configure_threads(intra_op, inter_op)
+    rss_before = _rss_mb()
+    t0 = time.monotonic()
+    generator = load_pipeline(engine, model_name)
+    load_seconds = time.monotonic() - t0
+    generator(prompt, max_new_tokens=8, do_sample=False)  # warmup
+
+    tokens = 0
+    elapsed = 0.0
+    text = ""
+    for _ in range(runs):
+        t0 = time.monotonic()
+        out = generator(prompt, max_new_tokens=max_new_tokens, do_sample=False, return_full_text=False)
+        elapsed += time.monotonic() - t0
+        text = out[0]["generated_text"]
+        tokens += len(generator.tokenizer(text, add_special_tokens=False)["input_ids"])
+    return {
+        "engine": engine,
+        "model": model_name,
+        "load_seconds": round(load_seconds, 2),
+        "tokens_per_second": round(tokens / elapsed, 2) if elapsed else None,
+        "rss_mb": round(_rss_mb(), 1),
+        "rss_model_mb": round(_rss_mb() - rss_before, 1),
+        "sanity": _sanity(text),
+        "sample": text[:200],
+    }
+
+
+def _benchmark_worker(queue, kwargs):
+    try:
+        queue.put(benchmark(**kwargs))
+    except Exception as e:
+        queue.put({"engine": kwargs["engine"], "error": str(e)})
+
+
+def compare(model_name: str, prompt: str, engines=None, **kwargs):
+    """Benchmark each engine in a fresh process so RSS numbers don't bleed into each other."""
+    import multiprocessing
+
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for engine in engines or ENGINES:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_benchmark_worker, args=(queue, dict(kwargs, engine=engine, model_name=model_name, prompt=prompt)))
+        proc.start()
+        results.append(queue.get())
+        proc.join()
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "compare":
+        print("usage: python engines.py compare [model_name]")
+        sys.exit(2)
+    model = sys.argv[2] if len(sys.argv) > 2 else os.getenv("HOPE_VAULT_MODEL", "distilgpt2")
+    sample_prompt = (
+        "Write a short, warm, uplifting story in en about resilience and hope. Use the theme: perseverance.\n\n"
+        "Here are some brief memories:\n- I had a nice walk in the park today.\n\n"
+        "Now write a gentle uplifting narrative (120-220 words) that weaves these memories and ends with a positive affirmation."
+    )
+    print(json.dumps(compare(model, sample_prompt), indent=2, ensure_ascii=False))
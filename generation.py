@@ -0,0 +1,202 @@
+import threading
+import time
+
+from aio import cancel_event
+from batching import GenerationBatcher
+from engines import configure_threads, load_pipeline
+from prefix_cache import PrefixKVCache, TokenCache
+
+# -----------------------
+# Text generation model lifecycle
+# -----------------------
+# Loading distilgpt2 takes seconds (and a download on a fresh box), so it
+# happens on a background thread started at app startup instead of at import
+# time. The model goes through loading -> warming -> ready (or failed).
+#
+# Streamed generations can't share the batcher's forward passes, so at most
+# ``max_streams`` of them run at once (each on its own thread, pushing tokens
+# through a TextIteratorStreamer); the rest wait for a slot. A stream stops
+# generating as soon as its consumer goes away (see aio.cancel_event).
+
+LOADING = "loading"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+
+class ModelManager:
+    def __init__(self, model_name: str, max_batch: int = 8, max_wait: float = 0.01,
+                 engine: str = "fp32", intra_op_threads: int = 0, inter_op_threads: int = 0, max_streams: int = 8):
+        self.model_name = model_name
+        self.engine = engine
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.state = LOADING
+        self.error = None
+        self.generator = None
+        self.batcher = None
+        self.prefix_cache = None
+        self.token_cache = None
+        self.load_seconds = None
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._ready = threading.Event()
+        self.max_streams = max_streams
+        self._stream_slots = threading.BoundedSemaphore(max_streams)
+        self._stream_lock = threading.Lock()
+        self.active_streams = 0
+
+    def start(self):
+        """Kick off loading + warmup in the background (idempotent)."""
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._load, name="model-warmup", daemon=True).start()
+
+    def _load(self):
+        t0 = time.monotonic()
+        try:
+            from transformers import set_seed
+
+            configure_threads(self.intra_op_threads, self.inter_op_threads)
+            self.generator = load_pipeline(self.engine, self.model_name)
+            set_seed(42)
+            self.state = WARMING
+            print(f"Text generator pipeline loaded: {self.model_name} ({self.engine})")
+            # one throwaway generation so the first real request doesn't pay
+            # for lazy allocations / kernel selection
+            self.generator("Hope is", max_new_tokens=8, do_sample=False)
+            self.batcher = GenerationBatcher(self.generator, max_batch=self.max_batch, max_wait=self.max_wait)
+            self.prefix_cache = PrefixKVCache(self.generator.model, self.generator.tokenizer)
+            self.token_cache = TokenCache(self.generator.tokenizer)
+            self.state = READY
+        except Exception as e:
+            self.generator = None
+            self.error = str(e)
+            self.state = FAILED
+            print("Warning: transformer pipeline failed to load:", e)
+        finally:
+            self.load_seconds = round(time.monotonic() - t0, 3)
+            self._ready.set()
+
+    def is_ready(self):
+        return self.state == READY
+
+    def is_settled(self):
+        """True once loading finished, successfully or not."""
+        return self.state in (READY, FAILED)
+
+    def wait_ready(self, timeout: float = 0):
+        """Wait up to ``timeout`` seconds for loading to finish; returns True if settled."""
+        self.start()
+        if not self.is_settled() and timeout > 0:
+            self._ready.wait(timeout)
+        return self.is_settled()
+
+    def stream(self, prompt: str, max_new_tokens: int, **gen_kwargs):
+        """Yield decoded text pieces as the model produces them (prompt not echoed).
+
+        Streams bypass the batcher: each one runs its own ``generate`` so tokens
+        can be pushed to the client as soon as they exist.
+        """
+        tokenizer = self.generator.tokenizer
+        inputs = tokenizer(
+            prompt,
+            return_tensors="pt",
+            truncation=True,
+            max_length=max(1, tokenizer.model_max_length - max_new_tokens),
+        )
+        return self._stream_generate(dict(inputs), max_new_tokens, gen_kwargs)
+
+    def stream_parts(self, prefix: str, lines, suffix: str, max_new_tokens: int, **gen_kwargs):
+        """Like ``stream`` for a prompt given as static prefix + keyed lines + suffix.
+
+        The prefix's past key/values come from the prefix cache, so only the
+        lines and suffix are prefilled. ``lines`` is [(cache_key, text), ...];
+        their token ids come from the token cache.
+        """
+        import torch
+
+        tokenizer = self.generator.tokenizer
+        prefix_ids, past = self.prefix_cache.get(prefix)
+        ids = list(prefix_ids)
+        for key, text in lines:
+            ids += self.token_cache.ids(key, text)
+        ids += self.token_cache.ids(("suffix", suffix), suffix)
+        if len(ids) > tokenizer.model_max_length - max_new_tokens:
+            # too long to keep the cached prefix: fall back to a plain, truncated prompt
+            return self.stream(prefix + "".join(t for _, t in lines) + suffix, max_new_tokens, **gen_kwargs)
+        inputs = {
+            "input_ids": torch.tensor([ids]),
+            "attention_mask": torch.ones(1, len(ids), dtype=torch.long),
+            "past_key_values": past,
+        }
+        return self._stream_generate(inputs, max_new_tokens, gen_kwargs)
+
+    def _stream_generate(self, inputs: dict, max_new_tokens: int, gen_kwargs: dict):
+        import torch
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+        tokenizer = self.generator.tokenizer
+        lm = self.generator.model
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        failure = []
+        # set when our consumer disconnects (async routes) or closes this generator
+        stop = cancel_event() or threading.Event()
+
+        class _Stopped(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return torch.full((input_ids.shape[0],), stop.is_set(), dtype=torch.bool, device=input_ids.device)
+
+        def _generate():
+            try:
+                lm.generate(
+                    **inputs,
+                    streamer=streamer,
+                    max_new_tokens=max_new_tokens,
+                    pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id,
+                    stopping_criteria=StoppingCriteriaList([_Stopped()]),
+                    **gen_kwargs,
+                )
+            except Exception as e:
+                failure.append(e)
+                streamer.end()
+            finally:
+                with self._stream_lock:
+                    self.active_streams -= 1
+                self._stream_slots.release()
+
+        while not self._stream_slots.acquire(timeout=0.1):
+            if stop.is_set():
+                return
+        with self._stream_lock:
+            self.active_streams += 1
+        worker = threading.Thread(target=_generate, name="story-stream", daemon=True)
+        worker.start()
+        try:
+            for piece in streamer:
+                if piece:
+                    yield piece
+        finally:
+            stop.set()  # no-op once generation finished; otherwise the consumer left early
+        worker.join()
+        if failure:
+            raise failure[0]
+
+    def count_tokens(self, text: str):
+        return len(self.generator.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def status(self):
+        return {
+            "model": self.model_name,
+            "engine": self.engine,
+            "state": self.state,
+            "ready": self.is_ready(),
+            "active_streams": self.active_streams,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+            "prefix_cache": self.prefix_cache.stats() if self.prefix_cache else None,
+        }
@@ -0,0 +1,236 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from storage import wal_connection
+
+# -----------------------
+# Background job queue
+# -----------------------
+# Heavy work (story generation, translation, TTS) can be submitted as a job:
+# the request returns a job id straight away and a bounded worker pool runs
+# the work. Each handler belongs to a pool ("model" for CPU-bound inference,
+# "io" for outbound calls) with its own concurrency limit and queue bound.
+# Job records live in their own SQLite file (JobStore), not in the vault, so
+# job churn never rewrites the vault. Every job has an owner (one worker
+# process); owners heartbeat, and a queued/running job whose owner stopped
+# heartbeating is claimed by exactly one other worker with a compare-and-set
+# and run again. Finished jobs are deleted after the retention period.
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+DEFAULT_LIMITS = {"model": os.cpu_count() or 1, "io": 16}
+
+
+class QueueFull(Exception):
+    """Raised when a pool's queue is at capacity; routes turn this into HTTP 429."""
+
+
+class JobStore:
+    """Job records and worker heartbeats, shared by every worker on the box."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        owner TEXT NOT NULL,
+        updated TEXT NOT NULL,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_status_updated ON jobs (status, updated);
+    CREATE TABLE IF NOT EXISTS workers (
+        id TEXT PRIMARY KEY,
+        seen REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+
+    def _conn(self):
+        return wal_connection(self._local, self.path)
+
+    def add(self, job: dict):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, owner, updated, data) VALUES (?, ?, ?, ?, ?)",
+                (job["id"], job["status"], job["owner"], job["updated"], json.dumps(job, ensure_ascii=False)),
+            )
+
+    def update(self, job: dict):
+        """Write ``job`` back unless another worker has claimed it meanwhile; returns whether it was written."""
+        conn = self._conn()
+        with conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, updated = ?, data = ? WHERE id = ? AND owner = ?",
+                (job["status"], job["updated"], json.dumps(job, ensure_ascii=False), job["id"], job["owner"]),
+            )
+        return cur.rowcount == 1
+
+    def claim(self, job: dict, owner: str):
+        """Take over an unfinished job from its previous owner; only one claimant can win."""
+        claimed = dict(job, owner=owner, status=QUEUED, updated=datetime.utcnow().isoformat())
+        conn = self._conn()
+        with conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, updated = ?, data = ? "
+                "WHERE id = ? AND owner = ? AND status IN (?, ?)",
+                (QUEUED, owner, claimed["updated"], json.dumps(claimed, ensure_ascii=False), job["id"], job["owner"],
+                 QUEUED, RUNNING),
+            )
+        return claimed if cur.rowcount == 1 else None
+
+    def get(self, job_id: str):
+        row = self._conn().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def heartbeat(self, worker: str):
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO workers (id, seen) VALUES (?, ?)", (worker, time.time()))
+
+    def orphans(self, alive_since: float):
+        """Unfinished jobs whose owner has not heartbeated since ``alive_since`` (epoch seconds)."""
+        rows = self._conn().execute(
+            "SELECT data FROM jobs WHERE status IN (?, ?) "
+            "AND owner NOT IN (SELECT id FROM workers WHERE seen >= ?)",
+            (QUEUED, RUNNING, alive_since),
+        ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def prune(self, finished_before: str, alive_since: float):
+        """Delete jobs that finished before ``finished_before`` and long-dead workers; returns jobs deleted."""
+        conn = self._conn()
+        with conn:
+            cur = conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?", (DONE, FAILED, finished_before)
+            )
+            conn.execute("DELETE FROM workers WHERE seen < ?", (alive_since,))
+        return cur.rowcount
+
+
+class JobQueue:
+    def __init__(self, store, limits: dict = None, max_queued: int = 64, heartbeat: float = 5.0,
+                 retention: float = 24 * 3600):
+        self.store = store
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.max_queued = max_queued
+        self.heartbeat = heartbeat
+        self.retention = retention  # seconds finished jobs (and their results) are kept
+        self.worker = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"  # unique even if pids are reused
+        self._handlers = {}  # job kind -> (callable, pool name)
+        self._pools = {}
+        self._depth = {}  # pool name -> queued + running jobs
+        self._lock = threading.Lock()
+        self._started = False
+
+    def register(self, kind: str, fn, pool: str = "io"):
+        self._handlers[kind] = (fn, pool)
+
+    def _pool(self, name: str):
+        if name not in self._pools:
+            self._pools[name] = ThreadPoolExecutor(max_workers=self.limits.get(name, 1), thread_name_prefix=f"jobs-{name}")
+            self._depth[name] = 0
+        return self._pools[name]
+
+    def start(self):
+        """Start heartbeating and take over jobs left behind by workers that stopped."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.store.heartbeat(self.worker)
+        self._maintain()
+        threading.Thread(target=self._maintain_loop, name="jobs-maintenance", daemon=True).start()
+
+    def _maintain_loop(self):
+        while True:
+            time.sleep(self.heartbeat)
+            try:
+                self.store.heartbeat(self.worker)
+                self._maintain()
+            except Exception as e:
+                print(f"Job maintenance failed: {e}")
+
+    def _maintain(self):
+        # an owner that missed three heartbeats is gone; its unfinished jobs are up for grabs
+        alive_since = time.time() - 3 * self.heartbeat
+        for job in self.store.orphans(alive_since):
+            if job.get("kind") not in self._handlers:
+                continue
+            claimed = self.store.claim(job, self.worker)
+            if claimed is not None:
+                self._dispatch(claimed, force=True)
+        finished_before = (datetime.utcnow() - timedelta(seconds=self.retention)).isoformat()
+        self.store.prune(finished_before, alive_since)
+
+    def depth(self):
+        with self._lock:
+            return dict(self._depth)
+
+    def submit(self, kind: str, **kwargs):
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind!r}")
+        self.start()  # other workers must see us heartbeat, or they would claim our jobs
+        now = datetime.utcnow().isoformat()
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": QUEUED,
+            "owner": self.worker,
+            "args": kwargs,
+            "result": None,
+            "error": None,
+            "created": now,
+            "updated": now,
+        }
+        return self._dispatch(job, new=True)
+
+    def get(self, job_id: str):
+        return self.store.get(job_id)
+
+    def _dispatch(self, job: dict, force: bool = False, new: bool = False):
+        _, pool_name = self._handlers[job["kind"]]
+        with self._lock:
+            pool = self._pool(pool_name)
+            if not force and self._depth[pool_name] >= self.limits[pool_name] + self.max_queued:
+                raise QueueFull(f"Too many pending {pool_name} jobs, retry later.")
+            self._depth[pool_name] += 1
+        if new:
+            self.store.add(job)
+        snapshot = dict(job)
+        pool.submit(self._run, job, pool_name)
+        return snapshot
+
+    def _update(self, job: dict, **changes):
+        job.update(changes, updated=datetime.utcnow().isoformat())
+        return self.store.update(job)
+
+    def _run(self, job: dict, pool_name: str):
+        fn, _ = self._handlers[job["kind"]]
+        try:
+            if not self._update(job, status=RUNNING):
+                return  # another worker took the job over; it runs there
+            result = fn(**job["args"])
+            if isinstance(result, dict) and result.get("error"):
+                self._update(job, status=FAILED, error=result["error"], result=result)
+            else:
+                self._update(job, status=DONE, result=result)
+        except Exception as e:
+            self._update(job, status=FAILED, error=str(e))
+        finally:
+            with self._lock:
+                self._depth[pool_name] -= 1
@@ -1,14 +1,87 @@
 # main.py
 import os
+import threading
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 # import router after app is created (safe)
 from routes import router
+import metrics
+import services
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class BodyLimitMiddleware:
+    """413 for request bodies over a per-path byte limit, decided before the body is stored.
+
+    FastAPI parses a multipart form (spooling files to disk) before the route
+    runs, so the route cannot enforce an upload cap itself. A declared
+    Content-Length over the limit is refused without reading anything; a body
+    without one is counted as it arrives and cut off at the limit.
+    """
+
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits  # path -> (max body bytes, error message)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.limits:
+            await self.app(scope, receive, send)
+            return
+        limit, message = self.limits[scope["path"]]
+        reject = JSONResponse(status_code=413, content={"error": message})
+        declared = dict(scope["headers"]).get(b"content-length", b"")
+        if declared.isdigit() and int(declared) > limit:
+            await reject(scope, receive, send)
+            return
+        state = {"received": 0, "tripped": False, "started": False}
+
+        async def limited_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+                if state["received"] > limit:
+                    state["tripped"] = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            if state["tripped"]:
+                return  # whatever the app made of the aborted body is replaced by the 413
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not state["tripped"]:
+                raise
+        if state["tripped"] and not state["started"]:
+            await reject(scope, receive, send)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # load + warm the story model in the background so startup isn't blocked
+    services.model.start()
+    # pick up jobs left queued/running by a previous worker
+    services.job_queue.start()
+    # first run with search: index the memories that are already in the vault
+    if services.search_index.fresh:
+        threading.Thread(target=services.backfill_search_index, name="search-backfill", daemon=True).start()
+    yield
+
 
 # 1) create FastAPI app first
 app = FastAPI(
+    lifespan=lifespan,
     title="Hope Vault - Free-tier Prototype",
     description="Generative Hope Vault: story generation + translation + TTS (local/free components).",
     version="0.1",
@@ -23,6 +96,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# uploads over the cap are refused while they arrive, not after they are on disk
+app.add_middleware(
+    BodyLimitMiddleware,
+    limits={"/api/upload": (services.UPLOAD_MAX_BODY_BYTES, f"Upload exceeds the {services.UPLOAD_MAX_MB:g} MB limit.")},
+)
+
+# outermost, so the timing covers CORS and the full (possibly streamed) response
+app.add_middleware(metrics.MetricsMiddleware, slow_request_ms=services.SLOW_REQUEST_MS)
+
 # 3) include router(s)
 app.include_router(router)
 
@@ -35,3 +117,15 @@ app.mount("/media", StaticFiles(directory=AUDIO_DIR), name="media")
 @app.get("/")
 def root():
     return {"ok": True, "message": "Hope Vault backend is running."}
+
+
+@app.get("/ready")
+def ready():
+    status = services.model.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,221 @@
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# -----------------------
+# In-process metrics (Prometheus text format)
+# -----------------------
+# Histograms/counters live in this worker's memory and are rendered on
+# GET /metrics. `span("stage")` times one stage of a request into
+# hope_vault_stage_seconds and also records it on the current request, so the
+# HTTP middleware can log a per-stage breakdown for slow requests.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_request_stages = contextvars.ContextVar("hope_vault_request_stages", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels))
+    return "{" + inner + "}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels tuple -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        for labels, series in items:
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_label_str(labels + (('le', f'{bound:g}'),))} {count}")
+            lines.append(f"{self.name}_bucket{_label_str(labels + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_str(labels)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_label_str(labels)} {series[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_label_str(labels)} {value:g}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time: a number, or a {labels tuple: number} dict."""
+
+    def __init__(self, name: str, help_text: str, fn):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if isinstance(value, dict):
+            lines.extend(f"{self.name}{_label_str(labels)} {v:g}" for labels, v in value.items())
+        else:
+            lines.append(f"{self.name} {value:g}")
+        return lines
+
+
+_registry = []
+
+
+def histogram(name: str, help_text: str, buckets=LATENCY_BUCKETS):
+    h = Histogram(name, help_text, buckets)
+    _registry.append(h)
+    return h
+
+
+def counter(name: str, help_text: str):
+    c = Counter(name, help_text)
+    _registry.append(c)
+    return c
+
+
+def gauge(name: str, help_text: str, fn):
+    g = Gauge(name, help_text, fn)
+    _registry.append(g)
+    return g
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+HTTP_SECONDS = histogram("hope_vault_http_request_seconds", "HTTP request latency by route.")
+STAGE_SECONDS = histogram("hope_vault_stage_seconds", "Latency of named request stages.")
+OUTBOUND_SECONDS = histogram("hope_vault_outbound_seconds", "Latency of calls to external services.")
+OUTBOUND_TOTAL = counter("hope_vault_outbound_requests_total", "Calls to external services by outcome.")
+GENERATION_TOKENS_PER_SECOND = histogram(
+    "hope_vault_generation_tokens_per_second", "Story generation throughput per request.", RATE_BUCKETS
+)
+
+
+# -----------------------
+# Spans
+# -----------------------
+@contextmanager
+def span(stage: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((stage, elapsed))
+
+
+@contextmanager
+def outbound(upstream: str):
+    """Time one call to an external service and count it as ok/error."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        OUTBOUND_TOTAL.inc(upstream=upstream, outcome="error")
+        raise
+    else:
+        OUTBOUND_TOTAL.inc(upstream=upstream, outcome="ok")
+    finally:
+        elapsed = time.perf_counter() - t0
+        OUTBOUND_SECONDS.observe(elapsed, upstream=upstream)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((f"outbound:{upstream}", elapsed))
+
+
+# -----------------------
+# ASGI middleware
+# -----------------------
+class MetricsMiddleware:
+    """Times every HTTP request (including streamed bodies) and logs slow ones per stage."""
+
+    def __init__(self, app, slow_request_ms: float = 0):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stages = []
+        token = _request_stages.set(stages)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - t0
+            _request_stages.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_SECONDS.observe(elapsed, method=scope["method"], route=path, status=status["code"])
+            if self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms:
+                breakdown = {}
+                for stage, seconds in stages:
+                    breakdown[stage] = round(breakdown.get(stage, 0) + seconds * 1000, 2)
+                print("Slow request:", json.dumps({
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status["code"],
+                    "ms": round(elapsed * 1000, 2),
+                    "stages_ms": breakdown,
+                }))
@@ -0,0 +1,243 @@
+import ipaddress
+import os
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+from aio import cancel_event
+from storage import _file_lock
+
+# -----------------------
+# Shared model server
+# -----------------------
+# With HOPE_VAULT_MODEL_SERVER set (a Unix socket path, or host:port), API
+# workers do not load the model themselves: one `python model_server.py`
+# process owns it, and every worker's requests land in that process's single
+# GenerationBatcher. HTTP workers can then be scaled for the I/O-bound routes
+# without multiplying model memory or oversubscribing torch threads.
+#
+#   HOPE_VAULT_MODEL_SERVER=/tmp/hope_vault_model.sock python model_server.py
+#
+# With HOPE_VAULT_MODEL_SERVER_AUTOSPAWN=1 the first worker that finds no
+# server running starts one itself.
+#
+# Security: multiprocessing.connection unpickles every message, so whoever can
+# connect and pass the HMAC handshake can run code in the server. The Unix
+# socket is created 0600 (only the app's user can connect). host:port is only
+# accepted on a loopback address and only with HOPE_VAULT_MODEL_SERVER_KEY set
+# to a secret shared by the server and the workers; there is no default key
+# for TCP. Never expose the port beyond the machine.
+
+DEFAULT_UNIX_KEY = "hope-vault"  # the socket's file permissions are what protect it
+
+
+def _parse_address(address: str):
+    if ":" in address and "/" not in address:
+        host, port = address.rsplit(":", 1)
+        return (host, int(port)), "AF_INET"
+    return address, "AF_UNIX"
+
+
+def _authkey(addr, family: str):
+    key = os.getenv("HOPE_VAULT_MODEL_SERVER_KEY")
+    if family == "AF_UNIX":
+        return (key or DEFAULT_UNIX_KEY).encode("utf-8")
+    host = addr[0]
+    try:
+        loopback = host == "localhost" or ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        loopback = False
+    if not loopback:
+        raise ValueError(f"model server address {host!r} is not loopback; only 127.0.0.1/::1/localhost are allowed")
+    if not key:
+        raise ValueError("a TCP model server needs HOPE_VAULT_MODEL_SERVER_KEY (a shared secret); or use a Unix socket")
+    return key.encode("utf-8")
+
+
+def _connect(address: str):
+    addr, family = _parse_address(address)
+    return Client(addr, family=family, authkey=_authkey(addr, family))
+
+
+# -----------------------
+# Server side
+# -----------------------
+def _handle(conn, manager):
+    try:
+        while True:
+            try:
+                req = conn.recv()
+            except EOFError:
+                return
+            op = req.get("op")
+            try:
+                if op == "status":
+                    conn.send({"ok": manager.status()})
+                elif not manager.is_ready():
+                    conn.send({"error": f"model not ready ({manager.state})"})
+                elif op == "count_tokens":
+                    conn.send({"ok": manager.count_tokens(req["text"])})
+                elif op == "generate":
+                    conn.send({"ok": manager.batcher.generate(req["prompt"], **req["kwargs"])})
+                elif op in ("stream", "stream_parts"):
+                    for piece in getattr(manager, op)(*req["args"], **req["kwargs"]):
+                        conn.send({"token": piece})
+                    conn.send({"end": True})
+                else:
+                    conn.send({"error": f"unknown op {op!r}"})
+            except Exception as e:
+                conn.send({"error": str(e)})
+    except (OSError, EOFError):
+        pass  # client went away mid-reply
+    finally:
+        conn.close()
+
+
+def serve(address: str, manager):
+    addr, family = _parse_address(address)
+    authkey = _authkey(addr, family)
+    if family == "AF_UNIX":
+        if os.path.exists(addr):
+            os.remove(addr)  # stale socket from a previous run
+        old_umask = os.umask(0o177)  # socket file is created 0600
+        try:
+            listener = Listener(addr, family=family, authkey=authkey)
+        finally:
+            os.umask(old_umask)
+    else:
+        listener = Listener(addr, family=family, authkey=authkey)
+    manager.start()
+    print(f"Model server listening on {address}")
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:  # failed handshake etc.
+            print("Warning: model server rejected a connection:", e)
+            continue
+        threading.Thread(target=_handle, args=(conn, manager), daemon=True).start()
+
+
+# -----------------------
+# Client side
+# -----------------------
+class RemoteModel:
+    """Drop-in for generation.ModelManager that forwards work to the model server."""
+
+    def __init__(self, address: str, autospawn: bool = False):
+        _authkey(*_parse_address(address))  # refuse an unsafe TCP setup at startup, not on the first request
+        self.address = address
+        self.autospawn = autospawn
+        self.batcher = self  # services calls model.batcher.generate(...)
+        self._status = None
+        self._status_at = 0.0
+
+    def _call(self, req: dict):
+        with _connect(self.address) as conn:
+            conn.send(req)
+            reply = conn.recv()
+        if "error" in reply:
+            raise RuntimeError(f"model server: {reply['error']}")
+        return reply["ok"]
+
+    def _stream(self, req: dict):
+        stop = cancel_event()
+        with _connect(self.address) as conn:
+            conn.send(req)
+            while True:
+                if stop is not None and stop.is_set():
+                    return  # hanging up makes the server stop generating
+                reply = conn.recv()
+                if "error" in reply:
+                    raise RuntimeError(f"model server: {reply['error']}")
+                if reply.get("end"):
+                    return
+                yield reply["token"]
+
+    def start(self):
+        if not self.autospawn or self._reachable():
+            return
+        addr, family = _parse_address(self.address)
+        lock_path = (addr if family == "AF_UNIX" else os.path.join(os.getcwd(), "model_server")) + ".lock"
+        with _file_lock(lock_path):
+            if self._reachable():
+                return  # another worker won the race
+            env = dict(os.environ, HOPE_VAULT_MODEL_SERVER=self.address)
+            script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_server.py")
+            subprocess.Popen([sys.executable, script], env=env, start_new_session=True)
+            for _ in range(100):
+                if self._reachable():
+                    return
+                time.sleep(0.1)
+
+    def _reachable(self):
+        try:
+            with _connect(self.address):
+                return True
+        except (OSError, EOFError):
+            return False
+
+    def status(self):
+        now = time.monotonic()
+        # ready is sticky, so once the server says so we can stop asking every request
+        if self._status and self._status.get("ready") and now - self._status_at < 5:
+            return self._status
+        try:
+            status = self._call({"op": "status"})
+        except (OSError, EOFError) as e:
+            status = {"model": None, "state": "loading", "ready": False, "error": f"model server unreachable: {e}"}
+        status["server"] = self.address
+        self._status, self._status_at = status, now
+        return status
+
+    @property
+    def state(self):
+        return self.status()["state"]
+
+    def is_ready(self):
+        return self.status()["ready"]
+
+    def is_settled(self):
+        return self.status()["state"] in ("ready", "failed")
+
+    def wait_ready(self, timeout: float = 0):
+        deadline = time.monotonic() + timeout
+        while not self.is_settled() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        return self.is_settled()
+
+    def generate(self, prompt: str, **kwargs):
+        return self._call({"op": "generate", "prompt": prompt, "kwargs": kwargs})
+
+    def count_tokens(self, text: str):
+        return self._call({"op": "count_tokens", "text": text})
+
+    def stream(self, prompt: str, max_new_tokens: int, **gen_kwargs):
+        return self._stream({"op": "stream", "args": (prompt, max_new_tokens), "kwargs": gen_kwargs})
+
+    def stream_parts(self, prefix: str, lines, suffix: str, max_new_tokens: int, **gen_kwargs):
+        return self._stream({"op": "stream_parts", "args": (prefix, list(lines), suffix, max_new_tokens), "kwargs": gen_kwargs})
+
+
+def _local_manager():
+    """The ModelManager services.py builds without a model server (same settings, same defaults).
+
+    Built here directly: importing services would also open the vault, caches,
+    search index and job queue in this process.
+    """
+    from generation import ModelManager
+
+    return ModelManager(
+        os.getenv("HOPE_VAULT_MODEL", "distilgpt2"),
+        max_batch=int(os.getenv("HOPE_VAULT_GEN_MAX_BATCH", "8")),
+        max_wait=float(os.getenv("HOPE_VAULT_GEN_MAX_WAIT_MS", "10")) / 1000,
+        engine=os.getenv("HOPE_VAULT_ENGINE", "fp32"),
+        intra_op_threads=int(os.getenv("HOPE_VAULT_TORCH_THREADS", "0")),
+        inter_op_threads=int(os.getenv("HOPE_VAULT_TORCH_INTEROP_THREADS", "0")),
+        max_streams=int(os.getenv("HOPE_VAULT_MODEL_WORKERS", os.getenv("HOPE_VAULT_GEN_MAX_BATCH", "8"))),
+    )
+
+
+if __name__ == "__main__":
+    serve(os.getenv("HOPE_VAULT_MODEL_SERVER") or "/tmp/hope_vault_model.sock", _local_manager())
@@ -0,0 +1,265 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# -----------------------
+# Shared outbound HTTP plumbing
+# -----------------------
+
+
+def pooled_session(pool_size: int = 32):
+    """A requests.Session that keeps connections alive and reuses up to ``pool_size`` per host."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# -----------------------
+# Resilient calls: deadlines, circuit breakers, bulkheads, hedging
+# -----------------------
+# Every call to an external service goes through an Upstream. A call gets a
+# timeout no longer than what is left of the current deadline (set once per
+# request with `deadline(seconds)` and carried across pools by contextvars),
+# waits at most that long for one of the upstream's concurrency slots, and is
+# refused straight away while the upstream's circuit is open. After
+# `failure_threshold` consecutive failures the circuit opens for
+# `reset_timeout` seconds; then a single half-open probe is let through and
+# its outcome closes or re-opens it. A slow upstream therefore costs a bounded
+# number of threads for a bounded time instead of every worker in the app.
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+_deadline = contextvars.ContextVar("hope_vault_outbound_deadline", default=None)
+
+
+class UpstreamUnavailable(RuntimeError):
+    """The call was not attempted: circuit open, no free slot, or the deadline already passed."""
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Budget every outbound call made inside the block (and in pools it submits to) to ``seconds`` in total.
+
+    Nested deadlines can only shorten the budget, never extend it.
+    """
+    if not seconds or seconds <= 0:
+        yield
+        return
+    at = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(at if outer is None else min(at, outer))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining(default: float = None):
+    """Seconds left in the current deadline (capped at ``default``); None without a deadline or default."""
+    at = _deadline.get()
+    if at is None:
+        return default
+    left = at - time.monotonic()
+    return left if default is None else min(left, default)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0  # consecutive
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may go ahead now; in half-open state only one probe at a time does."""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opens += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self):
+        """The allowed call ended without telling us anything about the upstream."""
+        with self._lock:
+            self._probing = False
+
+    def retry_in(self):
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+
+def _always(exc):
+    return True
+
+
+class Upstream:
+    """One external service: circuit breaker + concurrency limit + per-call timeout."""
+
+    def __init__(self, name: str, max_concurrency: int = 8, timeout: float = 15, failure_threshold: int = 5,
+                 reset_timeout: float = 30, is_failure=_always):
+        self.name = name
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.is_failure = is_failure  # exceptions that say nothing about the upstream's health (e.g. a 4xx) don't count
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = {"open": 0, "busy": 0, "deadline": 0}
+
+    def _reject(self, reason: str, message: str):
+        with self._lock:
+            self.rejected[reason] += 1
+        UPSTREAM_REJECTED.inc(upstream=self.name, reason=reason)
+        raise UpstreamUnavailable(f"{self.name}: {message}")
+
+    def call(self, fn):
+        """Run ``fn(timeout)``, where timeout is what the deadline leaves (at most self.timeout)."""
+        timeout = remaining(self.timeout)
+        if timeout is not None and timeout <= 0:
+            self._reject("deadline", "deadline exceeded")
+        if not self.breaker.allow():
+            self._reject("open", f"circuit open, retry in {self.breaker.retry_in():.1f}s")
+        if not self._slots.acquire(timeout=timeout):
+            self.breaker.release()
+            self._reject("busy", f"all {self.max_concurrency} connections busy")
+        try:
+            timeout = remaining(self.timeout)  # the wait for a slot came out of the budget
+            if timeout is not None and timeout <= 0:
+                self.breaker.release()
+                self._reject("deadline", "deadline exceeded")
+            with self._lock:
+                self.in_flight += 1
+            try:
+                with metrics.outbound(self.name):
+                    result = fn(timeout)
+            except Exception as e:
+                if self.is_failure(e):
+                    self.breaker.failure()
+                else:
+                    self.breaker.release()
+                raise
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+            self.breaker.success()
+            return result
+        finally:
+            self._slots.release()
+
+    def status(self):
+        with self._lock:
+            in_flight = self.in_flight
+            rejected = dict(self.rejected)
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "opens": self.breaker.opens,
+            "retry_in_seconds": round(self.breaker.retry_in(), 3),
+            "in_flight": in_flight,
+            "max_concurrency": self.max_concurrency,
+            "timeout_seconds": self.timeout,
+            "rejected": rejected,
+        }
+
+
+_upstreams = {}
+_upstreams_lock = threading.Lock()
+
+
+def upstream(name: str, **options):
+    """The process-wide Upstream called ``name`` (created with ``options`` on first use)."""
+    with _upstreams_lock:
+        if name not in _upstreams:
+            _upstreams[name] = Upstream(name, **options)
+        return _upstreams[name]
+
+
+def status():
+    with _upstreams_lock:
+        items = list(_upstreams.items())
+    return {name: u.status() for name, u in items}
+
+
+UPSTREAM_REJECTED = metrics.counter(
+    "hope_vault_outbound_rejected_total", "Outbound calls refused without contacting the upstream, by reason."
+)
+OUTBOUND_HEDGES = metrics.counter("hope_vault_outbound_hedges_total", "Hedged attempts started against a fallback upstream.")
+metrics.gauge(
+    "hope_vault_upstream_circuit_state", "Circuit breaker state per upstream (0 closed, 1 half-open, 2 open).",
+    lambda: {(("upstream", name),): _STATE_VALUES[u.breaker.state] for name, u in list(_upstreams.items())},
+)
+metrics.gauge(
+    "hope_vault_upstream_in_flight", "Outbound calls currently running per upstream.",
+    lambda: {(("upstream", name),): u.in_flight for name, u in list(_upstreams.items())},
+)
+
+# hedged attempts run here; each Upstream's own slots still bound what reaches the network
+_hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="outbound-hedge")
+
+
+def hedged(attempts, hedge_after: float):
+    """Call ``attempts`` (zero-argument callables, best first) until one succeeds.
+
+    The next attempt starts as soon as the previous one fails, or once it has
+    been running ``hedge_after`` seconds without answering; the first success
+    wins and slower attempts are left to finish (bounded by their timeouts).
+    Raises the last error if every attempt fails.
+    """
+    if len(attempts) == 1:
+        return attempts[0]()
+    pending = set()
+    errors = []
+    queue = list(attempts)
+    while queue or pending:
+        if queue:
+            if errors or pending:
+                OUTBOUND_HEDGES.inc()
+            pending.add(_hedge_pool.submit(contextvars.copy_context().run, queue.pop(0)))
+        wait_for = remaining(hedge_after) if queue else remaining()
+        done, pending = wait(pending, timeout=None if wait_for is None else max(wait_for, 0), return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                return future.result()
+            except Exception as e:
+                errors.append(e)
+        if not done and not queue:
+            raise UpstreamUnavailable("deadline exceeded waiting for hedged attempts")
+    raise errors[-1]
@@ -0,0 +1,79 @@
+import copy
+import threading
+from collections import OrderedDict
+
+# -----------------------
+# Prompt prefix KV cache + token cache
+# -----------------------
+# Every story prompt starts with the same instruction header for a given
+# (language, theme). PrefixKVCache keeps the model's past key/values for those
+# headers so generation only has to prefill the memory lines and the closing
+# instruction. TokenCache keeps the token ids of individual memory lines so an
+# entry is tokenized once, not on every story.
+
+
+class _LRU:
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TokenCache:
+    def __init__(self, tokenizer, max_items: int = 50000):
+        self.tokenizer = tokenizer
+        self._lru = _LRU(max_items)
+
+    def ids(self, key, text: str):
+        ids = self._lru.get(key)
+        if ids is None:
+            ids = self.tokenizer(text, add_special_tokens=False)["input_ids"]
+            self._lru.set(key, ids)
+        return ids
+
+
+class PrefixKVCache:
+    def __init__(self, model, tokenizer, max_items: int = 32):
+        self.model = model
+        self.tokenizer = tokenizer
+        self._lru = _LRU(max_items)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, prefix: str):
+        """Return (prefix token ids, private copy of the past key/values for them)."""
+        import torch
+
+        entry = self._lru.get(prefix)
+        if entry is None:
+            self.misses += 1
+            ids = self.tokenizer(prefix, add_special_tokens=False)["input_ids"]
+            with torch.no_grad():
+                out = self.model(torch.tensor([ids]), use_cache=True)
+            entry = (ids, out.past_key_values)
+            self._lru.set(prefix, entry)
+        else:
+            self.hits += 1
+        ids, past = entry
+        # generate() extends the cache in place, so every caller gets its own copy
+        return ids, copy.deepcopy(past)
+
+    def stats(self):
+        return {"items": len(self._lru), "hits": self.hits, "misses": self.misses}
@@ -1,12 +1,28 @@
 from fastapi import APIRouter, UploadFile, File, Form, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional
 import services
+from jobs import QueueFull, QUEUED, RUNNING, DONE
+import itertools
+import json
 import os
 
 router = APIRouter(prefix="/api", tags=["hopevault"])
 
 
+async def _model_not_ready():
+    # fail fast while the model is still loading instead of hanging the request
+    if await run_in_threadpool(services.model.wait_ready, services.MODEL_READY_WAIT_S):
+        return None
+    return JSONResponse(
+        status_code=503,
+        content={**services.model.status(), "error": "Story model is still warming up, retry shortly."},
+        headers={"Retry-After": "5"},
+    )
+
+
 class EntryIn(BaseModel):
     user_id: str
     text: str
@@ -18,6 +34,12 @@ class StoryReq(BaseModel):
     theme: Optional[str] = "perseverance"
     language: Optional[str] = "en"
     max_length: Optional[int] = 200
+    memories: Optional[str] = "recent"  # or "relevant": the memories that best match the theme
+
+
+class PipelineReq(StoryReq):
+    target_lang: Optional[str] = None  # translate + narrate in this language (default: the story's)
+    slow: bool = False
 
 
 class TranslateReq(BaseModel):
@@ -31,25 +53,112 @@ class TTSReq(BaseModel):
     slow: bool = False
 
 
+# Async routes below never block the event loop: vault/file work goes through
+# services.run_io and generation through services.run_model (see aio.py).
 @router.get("/prompt")
-def get_prompt(lang: Optional[str] = "en"):
+async def get_prompt(lang: Optional[str] = "en"):
     return {"prompt": services.get_daily_prompt(lang)}
 
 
 @router.post("/entry")
 async def add_entry(payload: EntryIn):
-    res = services.save_memory(payload.user_id, payload.text, payload.language)
+    res = await services.save_memory_async(payload.user_id, payload.text, payload.language)
     return res
 
 
 @router.get("/vault")
-def get_vault(user_id: str):
-    return services.get_user_vault(user_id)
+async def get_vault(request: Request, user_id: str, limit: Optional[int] = None, cursor: Optional[str] = None, since: Optional[str] = None):
+    etag = await services.run_io(services.vault_etag, user_id, limit=limit, cursor=cursor, since=since)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    try:
+        vault = await services.run_io(services.get_user_vault, user_id, limit=limit, cursor=cursor, since=since)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return JSONResponse(content=vault, headers={"ETag": etag})
+
+
+@router.get("/search")
+async def search(user_id: str, q: str, language: Optional[str] = None, limit: int = 20, offset: int = 0):
+    """Memories ranked by relevance to ``q``; pass ``next_offset`` back as ``offset`` for the next page."""
+    return await services.run_io(services.search_memories, user_id, q, language, limit, offset)
+
+
+@router.post("/vault/import")
+async def import_vault(request: Request, user_id: Optional[str] = None):
+    """NDJSON body: one entry per line (or lines from /vault/export), stored in a single commit.
+
+    Imported records keep their timestamps, so `since` delta syncs of /vault
+    miss them; clients need a full resync afterwards.
+    """
+    try:
+        return await services.import_vault(request.stream(), user_id)
+    except services.ImportRejected as e:
+        return JSONResponse(status_code=400, content={"error": str(e), "errors": e.errors})
+
+
+@router.get("/vault/export")
+async def export_vault(user_id: Optional[str] = None):
+    """Stream one user's vault (or every user's, without user_id) as NDJSON."""
+    return StreamingResponse(services.iterate_io(services.export_vault(user_id)), media_type="application/x-ndjson")
 
 
 @router.post("/generate_story")
-def generate_story(req: StoryReq):
-    return services.generate_uplifting_story(req.user_id, req.theme, req.language, req.max_length)
+async def generate_story(req: StoryReq):
+    busy = await _model_not_ready()
+    if busy is not None:
+        return busy
+    return await services.run_model(
+        services.generate_uplifting_story, req.user_id, req.theme, req.language, req.max_length, req.memories
+    )
+
+
+@router.post("/generate_story/stream")
+async def generate_story_stream(req: StoryReq):
+    """Server-sent events: `token` events with text pieces, then a `done` event with the saved story."""
+    busy = await _model_not_ready()
+    if busy is not None:
+        return busy
+
+    async def events():
+        stream = services.stream_uplifting_story(req.user_id, req.theme, req.language, req.max_length, req.memories)
+        async for event, data in services.iterate_model(stream):
+            payload = {"text": data} if event == "token" else {"story": data} if event == "done" else {"error": data}
+            yield f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.post("/story_pipeline/stream")
+async def story_pipeline_stream(req: PipelineReq, request: Request):
+    """Story, translation and speech in one request (server-sent events).
+
+    `token` events carry story text as it is written; a `segment` event
+    (sentence, translation, audio_url) follows as soon as each sentence is
+    voiced, while later ones are still being generated; `done` carries the
+    saved story with its translation and the audio URL of the whole story.
+    """
+    busy = await _model_not_ready()
+    if busy is not None:
+        return busy
+
+    async def events():
+        stream = services.run_story_pipeline(
+            req.user_id, req.theme, req.language, req.target_lang, req.slow, req.max_length, req.memories
+        )
+        async for event, data in services.iterate_model(stream):
+            if event == "token":
+                payload = {"text": data}
+            elif event == "segment":
+                payload = dict(data, audio_url=_public_audio_url(request, data["audio_file"])) if data.get("audio_file") else data
+            elif event == "done":
+                story = dict(data, audio_url=_public_audio_url(request, data["audio_file"])) if data.get("audio_file") else data
+                payload = {"story": story}
+            else:
+                payload = {"error": data}
+            yield f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 
 @router.post("/translate")
@@ -57,20 +166,117 @@ def translate(req: TranslateReq):
     return services.translate_text(req.text, req.target_lang)
 
 
+@router.get("/translate/stats")
+def translate_stats():
+    return services.translation_stats()
+
+
+@router.get("/upstreams")
+def upstreams():
+    """Circuit breaker state and load of each external service (LibreTranslate URLs, gTTS)."""
+    return services.upstream_status()
+
+
+def _public_audio_url(request: Request, local_path: str):
+    filename = os.path.basename(local_path)
+    base = str(request.base_url).rstrip("/")
+    return f"{base}/media/{filename}"
+
+
 @router.post("/text_to_speech")
 def text_to_speech(req_body: TTSReq, request: Request):
     res = services.text_to_speech(req_body.text, req_body.language, req_body.slow)
     if "error" in res:
         return res
     local_path = res.get("audio_file")
-    filename = os.path.basename(local_path)
-    base = str(request.base_url).rstrip("/")
-    public_url = f"{base}/media/{filename}"
-    return {"audio_file": local_path, "public_url": public_url}
+    return {"audio_file": local_path, "public_url": _public_audio_url(request, local_path), "cached": res.get("cached", False)}
+
+
+def _stream_speech(text: str, language: str, slow: bool, request: Request):
+    chunks, local_path = services.text_to_speech_stream(text, language, slow)
+    try:
+        # synthesize the first chunk up front so failures still get a JSON error
+        first = next(chunks, b"")
+    except Exception as e:
+        return JSONResponse(status_code=502, content={"error": f"TTS failed: {e}"})
+    headers = {"X-Audio-File": local_path, "X-Public-Url": _public_audio_url(request, local_path)}
+    return StreamingResponse(itertools.chain([first], chunks), media_type="audio/mpeg", headers=headers)
+
+
+@router.post("/text_to_speech/stream")
+def text_to_speech_stream(req_body: TTSReq, request: Request):
+    return _stream_speech(req_body.text, req_body.language, req_body.slow, request)
+
+
+# GET variant so an <audio src=...> (st.audio) can start playing while later chunks are synthesized
+@router.get("/text_to_speech/stream")
+def text_to_speech_stream_get(request: Request, text: str, language: str = "en", slow: bool = False):
+    return _stream_speech(text, language, slow, request)
+
+
+# -----------------------
+# Background jobs: submit returns a job id, poll /jobs/{id} for the outcome
+# -----------------------
+def _submit_job(kind: str, **kwargs):
+    try:
+        job = services.job_queue.submit(kind, **kwargs)
+    except QueueFull as e:
+        return JSONResponse(status_code=429, content={"error": str(e)}, headers={"Retry-After": "2"})
+    return JSONResponse(status_code=202, content={"job_id": job["id"], "status": job["status"]})
+
+
+def _job_view(job: dict, request: Request):
+    view = {k: job[k] for k in ("id", "kind", "status", "error", "created", "updated")}
+    result = job.get("result")
+    if job["kind"] == "text_to_speech" and isinstance(result, dict) and result.get("audio_file"):
+        result = dict(result, public_url=_public_audio_url(request, result["audio_file"]))
+    return view, result
+
+
+@router.post("/jobs/generate_story")
+def submit_generate_story(req: StoryReq):
+    return _submit_job(
+        "generate_story", user_id=req.user_id, theme=req.theme, language=req.language, max_length=req.max_length,
+        memories=req.memories,
+    )
+
+
+@router.post("/jobs/translate")
+def submit_translate(req: TranslateReq):
+    return _submit_job("translate", text=req.text, target_lang=req.target_lang)
+
+
+@router.post("/jobs/text_to_speech")
+def submit_text_to_speech(req: TTSReq):
+    return _submit_job("text_to_speech", text=req.text, language=req.language, slow=req.slow)
+
+
+@router.get("/jobs/{job_id}")
+def job_status(job_id: str, request: Request):
+    job = services.job_queue.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown job id."})
+    view, _ = _job_view(job, request)
+    return view
+
+
+@router.get("/jobs/{job_id}/result")
+def job_result(job_id: str, request: Request):
+    job = services.job_queue.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown job id."})
+    view, result = _job_view(job, request)
+    if job["status"] != DONE:
+        # still pending (202) or failed (the error is in the body)
+        return JSONResponse(status_code=202 if job["status"] in (QUEUED, RUNNING) else 200, content=dict(view, result=result))
+    return result
 
 
 # Optional: upload image / audio files (saved locally) - minimal example
 @router.post("/upload")
 async def upload_file(user_id: str = Form(...), file: UploadFile = File(...)):
-    path = await services.save_upload(user_id, file)
-    return {"uploaded_to": path}
+    try:
+        res = await services.save_upload(user_id, file)
+    except services.UploadTooLarge as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    return {"uploaded_to": res["path"], "sha256": res["sha256"], "size": res["size"], "duplicate": res["duplicate"]}
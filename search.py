@@ -0,0 +1,153 @@
+import heapq
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+from storage import wal_connection
+
+# -----------------------
+# Full-text search over memories
+# -----------------------
+# An inverted index in its own SQLite file, shared by every worker on the box
+# (like the translation DiskCache) and updated as memories are saved. Postings
+# are clustered on (user_id, term, language, entry_id), so a query only reads
+# the posting lists of its own terms for that one user: cost grows with the
+# number of matches, not with the size of the vault. Results are ranked with
+# BM25, using per-(user, language) document statistics.
+
+K1 = 1.2
+B = 0.75
+
+# \w alone would split Indic words at their vowel signs
+_TOKEN = re.compile(r"[\w\u0900-\u0dff]+")
+
+STOPWORDS = {
+    "en": frozenset(
+        "a an and are as at be been but by did do for from had has have i in is it its me my of on or so "
+        "that the their them then there they this to was we were what when which who will with you your".split()
+    ),
+}
+
+
+def tokenize(text: str, language: str = "en"):
+    stop = STOPWORDS.get(language, frozenset())
+    return [t for t in _TOKEN.findall(text.casefold()) if t not in stop]
+
+
+class SearchIndex:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS docs (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        language TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
+        length INTEGER NOT NULL,
+        text TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS postings (
+        user_id TEXT NOT NULL,
+        term TEXT NOT NULL,
+        language TEXT NOT NULL,
+        entry_id TEXT NOT NULL,
+        tf INTEGER NOT NULL,
+        PRIMARY KEY (user_id, term, language, entry_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS stats (
+        user_id TEXT NOT NULL,
+        language TEXT NOT NULL,
+        docs INTEGER NOT NULL,
+        total_length INTEGER NOT NULL,
+        PRIMARY KEY (user_id, language)
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fresh = not os.path.exists(path)  # nothing indexed yet; see services.backfill_search_index
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+
+    def _conn(self):
+        return wal_connection(self._local, self.path)
+
+    def add_many(self, rows):
+        """Index (user_id, entry) pairs in one transaction; entries already indexed are skipped.
+
+        Returns the number of entries added.
+        """
+        conn = self._conn()
+        added = 0
+        with conn:
+            for user_id, entry in rows:
+                language = entry.get("language") or "en"
+                terms = Counter(tokenize(entry.get("text", ""), language))
+                length = sum(terms.values())
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO docs (id, user_id, language, timestamp, length, text) VALUES (?, ?, ?, ?, ?, ?)",
+                    (entry["id"], user_id, language, entry.get("timestamp", ""), length, entry.get("text", "")),
+                )
+                if cur.rowcount == 0:
+                    continue
+                conn.executemany(
+                    "INSERT INTO postings (user_id, term, language, entry_id, tf) VALUES (?, ?, ?, ?, ?)",
+                    [(user_id, term, language, entry["id"], tf) for term, tf in terms.items()],
+                )
+                conn.execute(
+                    "INSERT INTO stats (user_id, language, docs, total_length) VALUES (?, ?, 1, ?) "
+                    "ON CONFLICT (user_id, language) DO UPDATE SET docs = docs + 1, total_length = total_length + excluded.total_length",
+                    (user_id, language, length),
+                )
+                added += 1
+        return added
+
+    def add(self, user_id: str, entry: dict):
+        return self.add_many([(user_id, entry)]) == 1
+
+    def search(self, user_id: str, query: str, language: str = None, limit: int = 20, offset: int = 0):
+        """BM25-ranked entries of one user matching any query term; returns (total matches, page)."""
+        terms = set(tokenize(query, language or "en"))
+        if not terms:
+            return 0, []
+        conn = self._conn()
+        lang_filter = " AND language = ?" if language else ""
+        lang_args = [language] if language else []
+        stats = {
+            lang: (docs, max(total_length / docs, 1.0))
+            for lang, docs, total_length in conn.execute(
+                "SELECT language, docs, total_length FROM stats WHERE user_id = ?" + lang_filter, [user_id] + lang_args
+            )
+            if docs
+        }
+        scores = {}
+        timestamps = {}
+        for term in terms:
+            rows = conn.execute(
+                "SELECT p.language, p.entry_id, p.tf, d.length, d.timestamp FROM postings p JOIN docs d ON d.id = p.entry_id "
+                "WHERE p.user_id = ? AND p.term = ?" + lang_filter.replace("language", "p.language"),
+                [user_id, term] + lang_args,
+            ).fetchall()
+            df = Counter(row[0] for row in rows)
+            weight = {lang: math.log(1 + (stats[lang][0] - n + 0.5) / (n + 0.5)) * (K1 + 1) for lang, n in df.items()}
+            for lang, entry_id, tf, length, timestamp in rows:
+                norm = tf + K1 * (1 - B + B * length / stats[lang][1])
+                scores[entry_id] = scores.get(entry_id, 0.0) + weight[lang] * tf / norm
+                timestamps[entry_id] = timestamp
+        # best match first; equally good matches newest first
+        top = heapq.nlargest(offset + limit, scores, key=lambda i: (scores[i], timestamps[i]))
+        page = top[offset:]
+        if not page:
+            return len(scores), []
+        marks = ",".join("?" * len(page))
+        docs = {
+            row[0]: row
+            for row in conn.execute(f"SELECT id, language, timestamp, text FROM docs WHERE id IN ({marks})", page)
+        }
+        results = [
+            {"id": i, "text": docs[i][3], "language": docs[i][1], "timestamp": docs[i][2], "score": round(scores[i], 4)}
+            for i in page
+        ]
+        return len(scores), results
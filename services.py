@@ -1,47 +1,150 @@
+import io
 import os
-import json
 import uuid
-from datetime import datetime
+import hashlib
+import base64
+import contextvars
+import json
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from typing import List
-import requests
 
-# Transformers
-from transformers import pipeline, set_seed
+import metrics
+import storage
+from aio import AsyncProxy, iterate_in, run_in
+from cache import MemoryLRU, DiskCache
+import outbound
+from outbound import pooled_session
+from translation import Translator
+from tts import AudioCache, ChunkedSpeech, SentenceStream, audio_key, split_sentences
+from generation import ModelManager
+from search import SearchIndex
+from model_server import RemoteModel
+from jobs import JobQueue, JobStore
 
 # gTTS
-from gtts import gTTS
+from gtts import gTTS, gTTSError
 
 # --- Config ---
 DB_FILE = "hope_vault_db.json"
+SQLITE_DB_FILE = "hope_vault.sqlite3"
+STORE_BACKEND = os.getenv("HOPE_VAULT_STORE", "cached")  # "cached", "json" or "sqlite"
+STORE_COMMIT_WINDOW_MS = float(os.getenv("HOPE_VAULT_COMMIT_WINDOW_MS", "5"))  # group-commit window
 UPLOAD_DIR = "uploads"
 AUDIO_DIR = "generated_audio"
-LIBRETRANSLATE_URL = "https://libretranslate.de/translate"  # public instance
-HF_MODEL_NAME = "distilgpt2"  # light local model; change if you want larger
+LIBRETRANSLATE_URL = os.getenv("HOPE_VAULT_LIBRETRANSLATE_URL", "https://libretranslate.de/translate")  # public instance
+LIBRETRANSLATE_FALLBACK_URLS = [u.strip() for u in os.getenv("HOPE_VAULT_LIBRETRANSLATE_FALLBACK_URLS", "").split(",") if u.strip()]
+TRANSLATE_HEDGE_MS = float(os.getenv("HOPE_VAULT_TRANSLATE_HEDGE_MS", "500"))  # ask a fallback when the primary is this slow; 0 = only on errors
+TRANSLATE_TIMEOUT_S = float(os.getenv("HOPE_VAULT_TRANSLATE_TIMEOUT_S", "15"))  # per LibreTranslate call
+GTTS_TIMEOUT_S = float(os.getenv("HOPE_VAULT_GTTS_TIMEOUT_S", "10"))  # per gTTS request
+GTTS_CHUNK_CHARS = 100  # gTTS's own per-request text limit
+OUTBOUND_BUDGET_S = float(os.getenv("HOPE_VAULT_OUTBOUND_BUDGET_S", "20"))  # total external-call time per translation/speech request
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("HOPE_VAULT_UPSTREAM_CONCURRENCY", "8"))  # in-flight calls per external service
+BREAKER_FAILURES = int(os.getenv("HOPE_VAULT_BREAKER_FAILURES", "5"))  # consecutive errors that open a circuit
+BREAKER_RESET_S = float(os.getenv("HOPE_VAULT_BREAKER_RESET_S", "30"))  # open circuits let a probe through after this
+TRANSLATION_CACHE_FILE = "translation_cache.sqlite3"
+SEARCH_INDEX_FILE = "search_index.sqlite3"
+STORY_MEMORY_COUNT = int(os.getenv("HOPE_VAULT_STORY_MEMORIES", "5"))  # memories woven into each story prompt
+TRANSLATION_MEMORY_CACHE_MB = float(os.getenv("HOPE_VAULT_TRANSLATION_MEMORY_CACHE_MB", "16"))
+TRANSLATION_DISK_CACHE_MB = float(os.getenv("HOPE_VAULT_TRANSLATION_DISK_CACHE_MB", "256"))
+AUDIO_CACHE_MB = float(os.getenv("HOPE_VAULT_AUDIO_CACHE_MB", "512"))  # disk budget for generated_audio/
+TTS_WORKERS = int(os.getenv("HOPE_VAULT_TTS_WORKERS", "4"))  # concurrent gTTS chunk syntheses
+UPLOAD_MAX_MB = float(os.getenv("HOPE_VAULT_UPLOAD_MAX_MB", "25"))
+UPLOAD_CHUNK_BYTES = 256 * 1024
+UPLOAD_MAX_BODY_BYTES = int(UPLOAD_MAX_MB * 1024 * 1024) + 64 * 1024  # the file plus multipart headers and form fields
+IMPORT_MAX_LINE_BYTES = int(os.getenv("HOPE_VAULT_IMPORT_MAX_LINE_KB", "256")) * 1024  # longest accepted NDJSON line
+IMPORT_MAX_ERRORS = 20  # invalid lines reported back per rejected import
+EXPORT_CHUNK_RECORDS = 256  # NDJSON lines per streamed export chunk
+HTTP_POOL_SIZE = int(os.getenv("HOPE_VAULT_HTTP_POOL_SIZE", "32"))
+HF_MODEL_NAME = os.getenv("HOPE_VAULT_MODEL", "distilgpt2")  # light local model; change if you want larger
+GEN_ENGINE = os.getenv("HOPE_VAULT_ENGINE", "fp32")  # "fp32" or "int8" (see engines.py)
+TORCH_THREADS = int(os.getenv("HOPE_VAULT_TORCH_THREADS", "0"))  # intra-op threads per worker, 0 = torch default
+TORCH_INTEROP_THREADS = int(os.getenv("HOPE_VAULT_TORCH_INTEROP_THREADS", "0"))
+MODEL_SERVER = os.getenv("HOPE_VAULT_MODEL_SERVER")  # socket path, or loopback host:port + HOPE_VAULT_MODEL_SERVER_KEY
+MODEL_SERVER_AUTOSPAWN = os.getenv("HOPE_VAULT_MODEL_SERVER_AUTOSPAWN", "0") == "1"
+GEN_MAX_BATCH = int(os.getenv("HOPE_VAULT_GEN_MAX_BATCH", "8"))
+GEN_MAX_WAIT_MS = float(os.getenv("HOPE_VAULT_GEN_MAX_WAIT_MS", "10"))
+IO_WORKERS = int(os.getenv("HOPE_VAULT_IO_WORKERS", "16"))  # threads for file/DB work from async routes
+MODEL_WORKERS = int(os.getenv("HOPE_VAULT_MODEL_WORKERS", str(GEN_MAX_BATCH)))  # concurrent generations per worker
+JOB_MODEL_WORKERS = int(os.getenv("HOPE_VAULT_JOB_MODEL_WORKERS", str(os.cpu_count() or 1)))
+JOB_IO_WORKERS = int(os.getenv("HOPE_VAULT_JOB_IO_WORKERS", "16"))
+JOB_MAX_QUEUED = int(os.getenv("HOPE_VAULT_JOB_MAX_QUEUED", "64"))  # per pool, beyond that submits get 429
+JOBS_DB_FILE = "jobs.sqlite3"
+JOB_RETENTION_HOURS = float(os.getenv("HOPE_VAULT_JOB_RETENTION_HOURS", "24"))  # finished jobs (and results) kept this long
+MODEL_READY_WAIT_S = float(os.getenv("HOPE_VAULT_MODEL_READY_WAIT_S", "2"))  # how long a request may queue during warmup
+SLOW_REQUEST_MS = float(os.getenv("HOPE_VAULT_SLOW_REQUEST_MS", "0"))  # log per-stage timings above this; 0 = off
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(AUDIO_DIR, exist_ok=True)
 
-# initialize or load DB
-if not os.path.exists(DB_FILE):
-    with open(DB_FILE, "w") as f:
-        json.dump({"users": {}}, f, indent=2)
+# initialize or load DB (JSON file or SQLite, see storage.py)
+store = storage.open_store(
+    STORE_BACKEND,
+    json_path=DB_FILE,
+    sqlite_path=SQLITE_DB_FILE,
+    commit_window=STORE_COMMIT_WINDOW_MS / 1000,
+)
+
+# Async routes reach the vault and the disk through io_executor (see aio.py)
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="hope-vault-io")
+astore = AsyncProxy(store, io_executor)
+
+
+async def run_io(fn, *args, **kwargs):
+    return await run_in(io_executor, fn, *args, **kwargs)
+
+
+def iterate_io(iterator):
+    """Async iterator over a blocking (disk/vault) iterator, advanced on io_executor."""
+    return iterate_in(io_executor, iterator)
+
+
+# full-text index over memories (see search.py); fed by save_memory and imports
+search_index = SearchIndex(SEARCH_INDEX_FILE)
+
+
+def backfill_search_index():
+    """Index memories saved before the search index existed (main.py runs this when the index file is new)."""
+    added = search_index.add_many((uid, r) for uid, kind, r in store.iter_records() if kind == "entries")
+    print(f"Search index: backfilled {added} memories")
 
-def _read_db():
-    with open(DB_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
 
-def _write_db(data):
-    with open(DB_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+def _db_size_bytes():
+    return os.path.getsize(SQLITE_DB_FILE if STORE_BACKEND == "sqlite" else DB_FILE)
 
-# Initialize text generator pipeline (takes time on first load)
-try:
-    text_generator = pipeline("text-generation", model=HF_MODEL_NAME)
-    set_seed(42)
-    print("Text generator pipeline loaded:", HF_MODEL_NAME)
-except Exception as e:
-    text_generator = None
-    print("Warning: transformer pipeline failed to load:", e)
+metrics.gauge("hope_vault_db_file_bytes", "Size of the vault database file.", _db_size_bytes)
+
+# Text generator is loaded + warmed up in the background; main.py calls
+# model.start() at app startup (see generation.py). With a model server
+# configured, this worker forwards generation to it instead (see model_server.py).
+if MODEL_SERVER:
+    model = RemoteModel(MODEL_SERVER, autospawn=MODEL_SERVER_AUTOSPAWN)
+else:
+    model = ModelManager(
+        HF_MODEL_NAME,
+        max_batch=GEN_MAX_BATCH,
+        max_wait=GEN_MAX_WAIT_MS / 1000,
+        engine=GEN_ENGINE,
+        intra_op_threads=TORCH_THREADS,
+        inter_op_threads=TORCH_INTEROP_THREADS,
+        max_streams=MODEL_WORKERS,
+    )
+
+# generations get their own bounded pool: enough callers to fill a batch, but
+# never enough to starve the threads serving cheap routes
+model_executor = ThreadPoolExecutor(max_workers=MODEL_WORKERS, thread_name_prefix="hope-vault-model")
+
+
+async def run_model(fn, *args, **kwargs):
+    return await run_in(model_executor, fn, *args, **kwargs)
+
+
+def iterate_model(iterator):
+    """Async iterator over a blocking generation stream, advanced on model_executor."""
+    return iterate_in(model_executor, iterator)
 
 
 # -----------------------
@@ -61,125 +164,693 @@ def get_daily_prompt(lang="en"):
 # Memory storage
 # -----------------------
 def save_memory(user_id: str, text: str, language: str = "en"):
-    db = _read_db()
-    if user_id not in db["users"]:
-        db["users"][user_id] = {"entries": [], "stories": []}
     entry = {
         "id": str(uuid.uuid4()),
         "text": text,
         "language": language,
         "timestamp": datetime.utcnow().isoformat()
     }
-    db["users"][user_id]["entries"].append(entry)
-    _write_db(db)
+    with metrics.span("db_write"):
+        store.append(user_id, "entries", entry)
+    with metrics.span("index"):
+        search_index.add(user_id, entry)
     return {"status": "saved", "entry": entry}
 
 
-def get_user_vault(user_id: str):
-    db = _read_db()
-    user = db["users"].get(user_id)
-    if not user:
-        return {"user_id": user_id, "entries": [], "stories": []}
-    return {"user_id": user_id, "entries": user.get("entries", []), "stories": user.get("stories", [])}
+async def save_memory_async(user_id: str, text: str, language: str = "en"):
+    """save_memory for async routes: the vault write runs on io_executor."""
+    return await run_io(save_memory, user_id, text, language)
+
+
+VAULT_KINDS = ("entries", "stories", "uploads")
+
+
+def _encode_cursor(position: dict):
+    raw = json.dumps(position, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor.")
+    if not isinstance(position, dict):
+        raise ValueError("Invalid cursor.")
+    for value in position.values():
+        # False (kind exhausted) or the [timestamp, id] of the last record served
+        if value is not False and not (isinstance(value, list) and len(value) == 2 and all(isinstance(v, str) for v in value)):
+            raise ValueError("Invalid cursor.")
+    return position
+
+
+def vault_etag(user_id: str, **params):
+    """ETag for a vault view: changes when the user's records change or the query differs."""
+    with metrics.span("db_read"):
+        version = store.user_version(user_id)
+    token = f"{version}|{sorted(params.items())}"
+    return 'W/"' + hashlib.sha1(token.encode("utf-8")).hexdigest() + '"'
+
+
+def get_user_vault(user_id: str, limit: int = None, cursor: str = None, since: str = None):
+    """Whole vault (no arguments), or a newest-first page of each record kind.
+
+    ``limit`` caps records per kind, ``cursor`` is the ``next_cursor`` of the
+    previous page, and ``since`` (an ISO timestamp, e.g. a previous response's
+    ``latest``) restricts the view to records newer than that, for delta sync.
+
+    Deltas compare record timestamps, not insertion order: records added by
+    import_vault keep their original (usually older) timestamps and never show
+    up in a delta, so a client must do a full resync after an import.
+    """
+    if limit is None and cursor is None and since is None:
+        with metrics.span("db_read"):
+            user = store.get_user(user_id)
+        if not user:
+            return {"user_id": user_id, "entries": [], "stories": [], "uploads": []}
+        return {
+            "user_id": user_id,
+            "entries": user.get("entries", []),
+            "stories": user.get("stories", []),
+            "uploads": user.get("uploads", []),
+        }
+
+    limit = max(1, min(int(limit or 50), 500))
+    position = _decode_cursor(cursor) if cursor else {}
+    result = {"user_id": user_id}
+    next_position = {}
+    latest = since
+    for kind in VAULT_KINDS:
+        before = position.get(kind)
+        if before is False:
+            # this kind was exhausted on an earlier page
+            result[kind] = []
+            next_position[kind] = False
+            continue
+        with metrics.span("db_read"):
+            records = store.page(user_id, kind, limit, before=before, since=since)
+        result[kind] = records
+        if len(records) < limit:
+            next_position[kind] = False
+        else:
+            last = records[-1]
+            next_position[kind] = [last.get("timestamp", ""), last["id"]]
+        if records and not before:
+            newest = records[0].get("timestamp", "")
+            latest = max(latest or "", newest)
+    more = any(p is not False for p in next_position.values())
+    result["next_cursor"] = _encode_cursor(next_position) if more else None
+    result["latest"] = latest
+    return result
+
+
+# -----------------------
+# Bulk NDJSON import / export
+# -----------------------
+class ImportRejected(ValueError):
+    def __init__(self, message: str, errors: list):
+        super().__init__(message)
+        self.errors = errors
+
+
+def _import_row(obj, user_id: str = None):
+    """Validate one import line: a bare entry, or a /vault/export line {"user_id", "kind", "record"}."""
+    if not isinstance(obj, dict):
+        raise ValueError("expected a JSON object")
+    if "record" in obj:
+        record, kind = obj["record"], obj.get("kind", "entries")
+        user_id = user_id or obj.get("user_id")
+    else:
+        record, kind = obj, "entries"
+    if not isinstance(user_id, str) or not user_id:
+        raise ValueError("missing user_id (pass ?user_id= or import export lines)")
+    if kind not in VAULT_KINDS:
+        raise ValueError(f"unknown kind {kind!r}")
+    if not isinstance(record, dict):
+        raise ValueError("record must be a JSON object")
+    if kind != "uploads" and (not isinstance(record.get("text"), str) or not record["text"].strip()):
+        raise ValueError("text must be a non-empty string")
+    record = dict(record)
+    record.setdefault("id", str(uuid.uuid4()))
+    if not isinstance(record["id"], str) or not record["id"]:
+        raise ValueError("id must be a non-empty string")
+    try:
+        ts = datetime.fromisoformat(record.get("timestamp") or datetime.utcnow().isoformat())
+    except (TypeError, ValueError):
+        raise ValueError("timestamp must be an ISO 8601 string")
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    # stored timestamps are naive UTC isoformat, which the vault orders as strings
+    record["timestamp"] = ts.isoformat()
+    if kind == "entries":
+        record.setdefault("language", "en")
+    return user_id, kind, record
+
+
+class _NdjsonSpool:
+    """Splits an NDJSON byte stream into lines, validates each one and spools valid rows to a temp file."""
+
+    def __init__(self, user_id: str = None):
+        self.user_id = user_id
+        self.file = tempfile.TemporaryFile("w+", encoding="utf-8")
+        self.pending = b""
+        self.lineno = 0
+        self.valid = 0
+        self.invalid = 0
+        self.errors = []
+
+    def feed(self, chunk: bytes):
+        *lines, self.pending = (self.pending + chunk).split(b"\n")
+        self._take(lines)
+        if len(self.pending) > IMPORT_MAX_LINE_BYTES:
+            raise ImportRejected(f"Line {self.lineno + 1} is longer than {IMPORT_MAX_LINE_BYTES} bytes.", self.errors)
+
+    def finish(self):
+        self._take([self.pending])
+        self.pending = b""
+
+    def _take(self, lines):
+        rows = []
+        for raw in lines:
+            self.lineno += 1
+            if not raw.strip():
+                continue
+            try:
+                row = _import_row(json.loads(raw), self.user_id)
+            except ValueError as e:  # includes JSON and UTF-8 decode errors
+                self.invalid += 1
+                if len(self.errors) < IMPORT_MAX_ERRORS:
+                    self.errors.append({"line": self.lineno, "error": str(e)})
+                continue
+            self.valid += 1
+            rows.append(json.dumps(row, ensure_ascii=False))
+        if rows and not self.invalid:
+            self.file.write("\n".join(rows) + "\n")
+
+    def rows(self):
+        self.file.seek(0)
+        for line in self.file:
+            yield tuple(json.loads(line))
+
+    def close(self):
+        self.file.close()
+
+
+async def import_vault(chunks, user_id: str = None):
+    """Bulk-add records from an NDJSON byte stream (``chunks`` is an async iterator) in one commit.
+
+    Lines are validated as they arrive and spooled to a temp file, so memory
+    use does not grow with the upload. All or nothing: if any line is invalid,
+    ImportRejected lists the first IMPORT_MAX_ERRORS problems and nothing is
+    stored. Records whose id is already in the vault are skipped, so a failed
+    backfill can simply be retried. Imported records keep their timestamps, so
+    ``since`` delta syncs do not see them (see get_user_vault); the result's
+    ``resync`` tells the caller that clients must fetch the vault again.
+    """
+    spool = await run_io(_NdjsonSpool, user_id)
+    try:
+        async for chunk in chunks:
+            await run_io(spool.feed, chunk)
+        await run_io(spool.finish)
+        if spool.invalid:
+            raise ImportRejected(f"{spool.invalid} invalid line(s); nothing was imported.", spool.errors)
+        with metrics.span("db_write"):
+            added = await run_io(store.ingest, spool.rows())
+        with metrics.span("index"):
+            await run_io(search_index.add_many, ((uid, r) for uid, kind, r in spool.rows() if kind == "entries"))
+    finally:
+        await run_io(spool.close)
+    return {"imported": added, "duplicates": spool.valid - added, "resync": added > 0}
+
+
+def export_vault(user_id: str = None):
+    """Yield the vault (one user's, or everyone's) as NDJSON bytes, a few hundred records at a time.
+
+    Each line is {"user_id", "kind", "record"}, which /vault/import accepts back.
+    """
+    lines = []
+    for uid, kind, record in store.iter_records(user_id):
+        lines.append(json.dumps({"user_id": uid, "kind": kind, "record": record}, ensure_ascii=False))
+        if len(lines) >= EXPORT_CHUNK_RECORDS:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+# -----------------------
+# Memory search
+# -----------------------
+MEMORY_SELECTIONS = ("recent", "relevant")
+
+
+def search_memories(user_id: str, query: str, language: str = None, limit: int = 20, offset: int = 0):
+    """Ranked full-text search over one user's memories; ``next_offset`` pages through the rest."""
+    limit = max(1, min(int(limit), 100))
+    offset = max(0, int(offset))
+    with metrics.span("search"):
+        total, results = search_index.search(user_id, query, language, limit, offset)
+    more = offset + len(results) < total
+    return {
+        "user_id": user_id,
+        "query": query,
+        "total": total,
+        "results": results,
+        "next_offset": offset + len(results) if more else None,
+    }
+
+
+def _story_memories(user_id: str, theme: str, memories: str = "recent"):
+    """Memories for a story prompt, oldest first.
+
+    "recent" takes the newest STORY_MEMORY_COUNT entries; "relevant" takes the
+    entries the search index ranks highest for ``theme``, topped up with the
+    newest ones when fewer match. Neither reads the whole vault.
+    """
+    with metrics.span("db_read"):
+        recent = store.page(user_id, "entries", STORY_MEMORY_COUNT)
+    picked = {}
+    if memories == "relevant" and recent:
+        with metrics.span("search"):
+            _, hits = search_index.search(user_id, theme, limit=STORY_MEMORY_COUNT)
+        for hit in hits:
+            picked[hit["id"]] = {k: hit[k] for k in ("id", "text", "language", "timestamp")}
+    for e in recent:
+        if len(picked) >= STORY_MEMORY_COUNT:
+            break
+        picked.setdefault(e["id"], e)
+    return sorted(picked.values(), key=lambda e: (e.get("timestamp", ""), e["id"]))
 
 
 # -----------------------
 # Story generation (updated to avoid HF warnings)
 # -----------------------
-def _build_story_prompt(entries: List[dict], theme: str, language: str):
+def _story_prompt_parts(entries: List[dict], theme: str, language: str):
+    """Split the story prompt into (header, [(line key, memory line)], closing instruction).
+
+    The header only depends on (language, theme) so the model's state for it
+    can be cached; memory lines are keyed by entry id for the token cache.
+    """
     header = f"Write a short, warm, uplifting story in {language} about resilience and hope. Use the theme: {theme}.\n\n"
     header += "Here are some brief memories:\n"
-    for e in entries[-5:]:
+    lines = []
+    for e in entries[-STORY_MEMORY_COUNT:]:
         ts = e.get("timestamp", "")[:10]
-        header += f"- {ts}: {e.get('text','')}\n"
-    header += "\nNow write a gentle uplifting narrative (120-220 words) that weaves these memories and ends with a positive affirmation."
-    return header
-
-def generate_uplifting_story(user_id: str, theme: str = "perseverance", language: str = "en", max_length: int = 200):
-    db = _read_db()
-    user = db["users"].get(user_id)
-    if not user or not user.get("entries"):
+        lines.append((e.get("id"), f"- {ts}: {e.get('text','')}\n"))
+    closing = "\nNow write a gentle uplifting narrative (120-220 words) that weaves these memories and ends with a positive affirmation."
+    return header, lines, closing
+
+
+def _build_story_prompt(entries: List[dict], theme: str, language: str):
+    header, lines, closing = _story_prompt_parts(entries, theme, language)
+    return header + "".join(line for _, line in lines) + closing
+
+def _fallback_story(entries: List[dict]):
+    story = " ".join([e["text"] for e in entries[-3:]])
+    return f"{story}\n\n(Unable to generate full narrative because model unavailable.)"
+
+
+def _save_story(user_id: str, story: str, theme: str, language: str, **extra):
+    story_record = {
+        "id": str(uuid.uuid4()),
+        "text": story,
+        "theme": theme,
+        "language": language,
+        "timestamp": datetime.utcnow().isoformat(),
+        **extra,
+    }
+    with metrics.span("db_write"):
+        store.append(user_id, "stories", story_record)
+    return story_record
+
+
+def _observe_generation(story: str, seconds: float):
+    try:
+        tokens = model.count_tokens(story)
+    except Exception:
+        return  # metrics must never fail a story
+    if tokens and seconds > 0:
+        metrics.GENERATION_TOKENS_PER_SECOND.observe(tokens / seconds)
+
+
+def generate_uplifting_story(user_id: str, theme: str = "perseverance", language: str = "en", max_length: int = 200,
+                             memories: str = "recent"):
+    if memories not in MEMORY_SELECTIONS:
+        return {"error": f"memories must be one of {', '.join(MEMORY_SELECTIONS)}."}
+    entries = _story_memories(user_id, theme, memories)
+    if not entries:
         return {"error": "No entries found for user. Add memories first via /api/entry."}
 
-    entries = user["entries"]
-    prompt = _build_story_prompt(entries, theme, language)
+    with metrics.span("prompt_build"):
+        prompt = _build_story_prompt(entries, theme, language)
 
     # --- NEW: explicit generation params to avoid HF warnings ---
     max_new_tokens = min(256, max(64, max_length))
     try:
-        if text_generator is None:
-            story = " ".join([e["text"] for e in entries[-3:]])
-            story = f"{story}\n\n(Unable to generate full narrative because model unavailable.)"
+        if not model.is_ready():
+            story = _fallback_story(entries)
         else:
-            gen = text_generator(
-                prompt,
-                max_new_tokens=max_new_tokens,
-                truncation=True,
-                do_sample=True,
-                top_p=0.95,
-                temperature=0.8,
-                num_return_sequences=1
-            )
+            t0 = time.perf_counter()
+            with metrics.span("generate"):
+                gen = model.batcher.generate(
+                    prompt,
+                    max_new_tokens=max_new_tokens,
+                    truncation=True,
+                    do_sample=True,
+                    top_p=0.95,
+                    temperature=0.8,
+                    num_return_sequences=1,
+                    # store only the story, not the echoed prompt
+                    return_full_text=False
+                )
             # Hugging Face returns generated_text or text depending on model/pipeline version
             story = gen[0].get("generated_text") or gen[0].get("text") or str(gen[0])
+            _observe_generation(story, time.perf_counter() - t0)
     except Exception as e:
         story = "Error generating story: " + str(e)
 
     # Save story in DB
-    story_record = {
-        "id": str(uuid.uuid4()),
-        "text": story,
-        "theme": theme,
-        "language": language,
-        "timestamp": datetime.utcnow().isoformat()
-    }
-    db["users"][user_id].setdefault("stories", []).append(story_record)
-    _write_db(db)
-    return {"story": story_record}
+    return {"story": _save_story(user_id, story, theme, language)}
+
+
+def _story_tokens(user_id: str, theme: str, language: str, max_length: int, memories: str):
+    """Yield ("token", text) pieces of a new story, or ("error", message).
+
+    Returns the finished story text, or None when there was nothing to write about.
+    """
+    if memories not in MEMORY_SELECTIONS:
+        yield "error", f"memories must be one of {', '.join(MEMORY_SELECTIONS)}."
+        return None
+    entries = _story_memories(user_id, theme, memories)
+    if not entries:
+        yield "error", "No entries found for user. Add memories first via /api/entry."
+        return None
+
+    with metrics.span("prompt_build"):
+        header, lines, closing = _story_prompt_parts(entries, theme, language)
+    max_new_tokens = min(256, max(64, max_length))
+    pieces = []
+    try:
+        if not model.is_ready():
+            pieces.append(_fallback_story(entries))
+            yield "token", pieces[-1]
+        else:
+            # the header's KV state is reused from the prefix cache, so only the memories are prefilled
+            lines = [((user_id, key), line) for key, line in lines]
+            t0 = time.perf_counter()
+            with metrics.span("generate"):
+                for piece in model.stream_parts(header, lines, closing, max_new_tokens, do_sample=True, top_p=0.95, temperature=0.8):
+                    pieces.append(piece)
+                    yield "token", piece
+            _observe_generation("".join(pieces), time.perf_counter() - t0)
+        story = "".join(pieces).strip()
+    except Exception as e:
+        story = "Error generating story: " + str(e)
+        yield "error", story
+    return story
+
+
+def stream_uplifting_story(user_id: str, theme: str = "perseverance", language: str = "en", max_length: int = 200,
+                           memories: str = "recent"):
+    """Streaming variant of generate_uplifting_story.
+
+    Yields ("token", text) pieces as they are generated, then ("done", story_record)
+    once the finished story is saved, or a single ("error", message).
+    """
+    story = yield from _story_tokens(user_id, theme, language, max_length, memories)
+    if story is not None:
+        yield "done", _save_story(user_id, story, theme, language)
 
 
 # -----------------------
 # Translation via LibreTranslate
 # -----------------------
+# one keep-alive session for every outbound call
+http_session = pooled_session(HTTP_POOL_SIZE)
+
+translator = Translator(
+    LIBRETRANSLATE_URL,
+    http_session,
+    MemoryLRU(int(TRANSLATION_MEMORY_CACHE_MB * 1024 * 1024)),
+    DiskCache(TRANSLATION_CACHE_FILE, int(TRANSLATION_DISK_CACHE_MB * 1024 * 1024)),
+    timeout=TRANSLATE_TIMEOUT_S,
+    fallback_urls=LIBRETRANSLATE_FALLBACK_URLS,
+    hedge_after=TRANSLATE_HEDGE_MS / 1000 if TRANSLATE_HEDGE_MS > 0 else None,
+    max_concurrency=UPSTREAM_MAX_CONCURRENCY,
+    failure_threshold=BREAKER_FAILURES,
+    reset_timeout=BREAKER_RESET_S,
+)
+
+
 def translate_text(text: str, target_lang: str = "hi"):
     try:
-        resp = requests.post(
-            LIBRETRANSLATE_URL,
-            data={
-                "q": text,
-                "source": "auto",
-                "target": target_lang,
-                "format": "text"
-            },
-            timeout=15
-        )
-        resp.raise_for_status()
-        translated = resp.json().get("translatedText")
+        with metrics.span("translate"), outbound.deadline(OUTBOUND_BUDGET_S):
+            translated = translator.translate(text, target_lang)
         return {"translatedText": translated}
     except Exception as e:
         return {"error": f"Translation failed: {e}"}
 
 
+def translation_stats():
+    return translator.stats()
+
+
+def upstream_status():
+    """Circuit state, in-flight calls and refusals of every external service (see outbound.py)."""
+    return outbound.status()
+
+
 # -----------------------
 # Text-to-Speech (gTTS)
 # -----------------------
+audio_cache = AudioCache(AUDIO_DIR, int(AUDIO_CACHE_MB * 1024 * 1024))
+chunked_speech = ChunkedSpeech(audio_cache, max_workers=TTS_WORKERS)
+
+# gTTS raises ValueError for unsupported languages: our mistake, not Google's outage
+gtts_upstream = outbound.upstream(
+    "gtts", max_concurrency=UPSTREAM_MAX_CONCURRENCY, timeout=GTTS_TIMEOUT_S, failure_threshold=BREAKER_FAILURES,
+    reset_timeout=BREAKER_RESET_S, is_failure=lambda e: isinstance(e, (gTTSError, OSError)),
+)
+
+
+def _gtts_write(text: str, language: str, slow: bool, fp):
+    # gTTS sends one request per ~100 characters, each allowed the whole timeout;
+    # going a request-sized chunk at a time re-checks the deadline between them
+    for chunk in split_sentences(text, GTTS_CHUNK_CHARS):
+        gtts_upstream.call(lambda timeout: gTTS(text=chunk, lang=language, slow=slow, timeout=timeout).write_to_fp(fp))
+
+
+def _gtts_save(text: str, language: str, slow: bool, path: str):
+    with open(path, "wb") as f:
+        _gtts_write(text, language, slow, f)
+
+
 def text_to_speech(text: str, language: str = "en", slow: bool = False):
     try:
-        filename = f"{AUDIO_DIR}/story_{uuid.uuid4().hex}.mp3"
-        tts = gTTS(text=text, lang=language, slow=slow)
-        tts.save(filename)
-        return {"audio_file": filename}
+        def synthesize(path):
+            _gtts_save(text, language, slow, path)
+
+        with metrics.span("tts"), outbound.deadline(OUTBOUND_BUDGET_S):
+            filename, cached = audio_cache.get_or_create(audio_key(text, language, slow), synthesize)
+        return {"audio_file": filename, "cached": cached}
     except Exception as e:
         return {"error": f"TTS failed: {e}"}
 
 
+def text_to_speech_stream(text: str, language: str = "en", slow: bool = False):
+    """Chunked, parallel TTS. Returns (mp3 byte iterator, audio_file the full mp3 is saved to)."""
+    def synthesize_bytes(chunk):
+        buf = io.BytesIO()
+        _gtts_write(chunk, language, slow, buf)
+        return buf.getvalue()
+
+    key = audio_key(text, language, slow)
+    return chunked_speech.stream(key, text, synthesize_bytes), audio_cache.path_for(key)
+
+
+# -----------------------
+# Story -> translation -> speech pipeline
+# -----------------------
+# Each sentence is translated and voiced on pipeline_pool as soon as the model
+# has written it, while later sentences are still being generated, so the
+# first audio is ready long before the story is finished.
+pipeline_pool = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="story-pipeline")
+
+
+def _pipeline_segment(sentence: str, language: str, target_lang: str, slow: bool):
+    # "translation" is only set once the sentence really is in target_lang
+    segment = {"text": sentence}
+    try:
+        with outbound.deadline(OUTBOUND_BUDGET_S):
+            if target_lang != language:
+                with metrics.span("translate"):
+                    segment["translation"] = translator.translate(sentence, target_lang)
+            else:
+                segment["translation"] = sentence
+
+            def synthesize(path):
+                _gtts_save(segment["translation"], target_lang, slow, path)
+
+            with metrics.span("tts"):
+                segment["audio_file"], _ = audio_cache.get_or_create(audio_key(segment["translation"], target_lang, slow), synthesize)
+    except Exception as e:
+        segment["error"] = f"Segment failed: {e}"
+    return segment
+
+
+def _join_audio(segments, target_lang: str, slow: bool):
+    """Concatenate the segments' mp3s into one cached file for the whole translation (None on failure)."""
+    if not segments or any("audio_file" not in s for s in segments):
+        return None
+    text = " ".join(s["translation"] for s in segments)
+
+    def concat(path):
+        with open(path, "wb") as out:
+            for s in segments:
+                with open(s["audio_file"], "rb") as f:
+                    shutil.copyfileobj(f, out)
+
+    try:
+        return audio_cache.get_or_create(audio_key(text, target_lang, slow), concat)[0]
+    except OSError:
+        return None  # a segment was evicted meanwhile; the segments themselves were delivered
+
+
+def run_story_pipeline(user_id: str, theme: str = "perseverance", language: str = "en", target_lang: str = None,
+                       slow: bool = False, max_length: int = 200, memories: str = "recent"):
+    """Generate a story, translating and voicing it sentence by sentence as it is written.
+
+    Yields ("token", text) as the story streams, ("segment", {index, text,
+    translation, audio_file}) as each sentence's audio is ready (in order;
+    a failed segment has "error" instead of what it could not produce), or
+    ("error", message); finally ("done", story_record), the saved story with
+    its translation (or the translation error) and the audio file of the
+    whole thing.
+    """
+    target_lang = target_lang or language
+    sentences = SentenceStream()
+    futures = []
+    segments = []
+
+    def submit(batch):
+        for sentence in batch:
+            futures.append(pipeline_pool.submit(contextvars.copy_context().run, _pipeline_segment, sentence, language, target_lang, slow))
+
+    def finished(wait: bool):
+        while len(segments) < len(futures) and (wait or futures[len(segments)].done()):
+            segment = dict(futures[len(segments)].result(), index=len(segments))
+            segments.append(segment)
+            yield "segment", segment
+
+    failed = False
+    tokens = _story_tokens(user_id, theme, language, max_length, memories)
+    try:
+        while True:
+            event, data = next(tokens)
+            yield event, data
+            if event == "error":
+                failed = True  # don't voice the error message
+            elif not failed:
+                submit(sentences.feed(data))
+            yield from finished(False)
+    except StopIteration as stop:
+        story = stop.value
+    if story is None:
+        return
+    if not failed:
+        submit(sentences.finish())
+    yield from finished(True)
+
+    extra = {"audio_file": _join_audio(segments, target_lang, slow)}
+    if target_lang != language:
+        untranslated = [s["index"] for s in segments if "translation" not in s]
+        if untranslated:
+            # never pass the source text off as the translation
+            extra["translation"] = {"language": target_lang, "error": "Translation failed", "failed_segments": untranslated}
+        else:
+            extra["translation"] = {"language": target_lang, "text": " ".join(s["translation"] for s in segments)}
+    yield "done", _save_story(user_id, story, theme, language, **extra)
+
+
 # -----------------------
 # Simple upload saving (images/audio)
 # -----------------------
+class UploadTooLarge(ValueError):
+    pass
+
+
+def _finish_upload(tmp_path: str, digest: str, ext: str):
+    """Move a finished temp upload to its content-addressed path; returns (path, duplicate)."""
+    dest_dir = os.path.join(UPLOAD_DIR, digest[:2])
+    os.makedirs(dest_dir, exist_ok=True)
+    path = os.path.join(dest_dir, f"{digest}{ext}")
+    if os.path.exists(path):
+        os.remove(tmp_path)
+        return path, True
+    os.replace(tmp_path, path)
+    return path, False
+
+
 async def save_upload(user_id: str, upload):
-    fname = f"{user_id}_{uuid.uuid4().hex}_{upload.filename}"
-    path = os.path.join(UPLOAD_DIR, fname)
-    with open(path, "wb") as f:
-        content = await upload.read()
-        f.write(content)
-    return path
+    """Stream an upload to disk in fixed-size chunks, hashing as we go.
+
+    Identical files are stored once under uploads/<sha256[:2]>/<sha256><ext>;
+    each user gets an "uploads" record in the vault pointing at it.
+    """
+    max_bytes = int(UPLOAD_MAX_MB * 1024 * 1024)
+    ext = os.path.splitext(upload.filename or "")[1].lower()[:16]
+    tmp_path = os.path.join(UPLOAD_DIR, f".incoming_{uuid.uuid4().hex}")
+    digest = hashlib.sha256()
+    size = 0
+    f = await run_io(open, tmp_path, "wb")
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"Upload exceeds the {UPLOAD_MAX_MB:g} MB limit.")
+            digest.update(chunk)
+            await run_io(f.write, chunk)
+    except BaseException:
+        await run_io(f.close)
+        await run_io(os.remove, tmp_path)
+        raise
+    await run_io(f.close)
+
+    sha = digest.hexdigest()
+    path, duplicate = await run_io(_finish_upload, tmp_path, sha, ext)
+    record = {
+        "id": str(uuid.uuid4()),
+        "filename": upload.filename,
+        "content_type": upload.content_type,
+        "path": path,
+        "sha256": sha,
+        "size": size,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    with metrics.span("db_write"):
+        await astore.append(user_id, "uploads", record)
+    return {"path": path, "sha256": sha, "size": size, "duplicate": duplicate, "upload": record}
+
+
+# -----------------------
+# Background jobs (see jobs.py)
+# -----------------------
+def _story_job(**kwargs):
+    # queued story jobs wait out the model warmup instead of getting the fallback text
+    model.wait_ready(timeout=300)
+    return generate_uplifting_story(**kwargs)
+
+
+job_queue = JobQueue(
+    JobStore(JOBS_DB_FILE),
+    limits={"model": JOB_MODEL_WORKERS, "io": JOB_IO_WORKERS},
+    max_queued=JOB_MAX_QUEUED,
+    retention=JOB_RETENTION_HOURS * 3600,
+)
+job_queue.register("generate_story", _story_job, pool="model")
+job_queue.register("translate", translate_text, pool="io")
+job_queue.register("text_to_speech", text_to_speech, pool="io")
@@ -0,0 +1,572 @@
+import os
+import bisect
+import glob
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+# -----------------------
+# Vault storage backends
+# -----------------------
+# A vault is {"users": {user_id: {"entries": [...], "stories": [...]}}}.
+# Every record carries "id" and "timestamp"; the store only cares about those
+# two fields plus the record kind ("entries", "stories", ...), the rest is an
+# opaque JSON payload. Background jobs are not part of the vault (see
+# jobs.JobStore).
+
+RECORD_KINDS = ("entries", "stories", "uploads")
+
+
+def _empty_user():
+    return {kind: [] for kind in RECORD_KINDS}
+
+
+def _record_key(record):
+    return record.get("timestamp", ""), record["id"]
+
+
+def _add_sorted(records, new_records):
+    """Add to a record list kept in (timestamp, id) order; new records normally just go on the end."""
+    for record in new_records:
+        if not records or _record_key(record) >= _record_key(records[-1]):
+            records.append(record)
+        else:
+            bisect.insort(records, record, key=_record_key)
+
+
+def _page_newest_first(records, limit: int, before=None, since: str = None):
+    """Walk a record list kept in (timestamp, id) order (see _add_sorted) from the end.
+
+    Returns up to ``limit`` records ordered newest first, strictly older than
+    the ``before`` (timestamp, id) position and newer than ``since``.
+    """
+    out = []
+    for r in reversed(records):
+        key = _record_key(r)
+        if before is not None and key >= tuple(before):
+            continue
+        if since is not None and key[0] <= since:
+            break
+        out.append(r)
+        if len(out) >= limit:
+            break
+    return out
+
+
+def _ingest_into(data, rows):
+    """Add (user_id, kind, record) rows to an in-memory vault; returns how many were new."""
+    seen = {r["id"] for user in data["users"].values() for records in user.values() for r in records}
+    touched = set()
+    added = 0
+    for user_id, kind, record in rows:
+        if record["id"] in seen:
+            continue
+        seen.add(record["id"])
+        data["users"].setdefault(user_id, _empty_user()).setdefault(kind, []).append(record)
+        touched.add((user_id, kind))
+        added += 1
+    # backfills may be older than (or tie with) what is stored; keep every list in (timestamp, id) order
+    for user_id, kind in touched:
+        data["users"][user_id][kind].sort(key=_record_key)
+    return added
+
+
+class VaultStore:
+    """Interface shared by every storage backend."""
+
+    def get_user(self, user_id: str):
+        """Return {"entries": [...], "stories": [...]} or None for unknown users."""
+        raise NotImplementedError
+
+    def list_records(self, user_id: str, kind: str):
+        user = self.get_user(user_id)
+        return list(user.get(kind, [])) if user else []
+
+    def page(self, user_id: str, kind: str, limit: int, before=None, since: str = None):
+        """Newest-first page of one record kind (see _page_newest_first)."""
+        return _page_newest_first(self.list_records(user_id, kind), limit, before, since)
+
+    def user_version(self, user_id: str):
+        """Cheap token that changes whenever the user's vault changes (used for ETags)."""
+        user = self.get_user(user_id) or {}
+        return "|".join(
+            f"{kind}:{len(records)}:{records[-1]['id'] if records else ''}" for kind, records in sorted(user.items())
+        )
+
+    def append(self, user_id: str, kind: str, record: dict):
+        raise NotImplementedError
+
+    def append_many(self, user_id: str, kind: str, records):
+        for record in records:
+            self.append(user_id, kind, record)
+
+    def ingest(self, rows):
+        """Store (user_id, kind, record) rows in a single commit, skipping ids already present.
+
+        ``rows`` may be any iterable (it is consumed once); returns the number of records added.
+        """
+        raise NotImplementedError
+
+    def user_ids(self):
+        raise NotImplementedError
+
+    def iter_records(self, user_id: str = None):
+        """Yield (user_id, kind, record) for one user or the whole vault, one user at a time."""
+        for uid in [user_id] if user_id is not None else self.user_ids():
+            for kind, records in (self.get_user(uid) or {}).items():
+                for record in records:
+                    yield uid, kind, record
+
+    def close(self):
+        pass
+
+
+class JsonStore(VaultStore):
+    """The original single-file JSON vault (rewritten in full on every change)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        if not os.path.exists(path):
+            self._dump_file({"users": {}})
+
+    def _load_file(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _dump_file(self, data):
+        data.pop("jobs", None)  # left over from when job records were kept in the vault
+        # write to a temp file and rename so readers never see a half-written vault
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def get_user(self, user_id: str):
+        return self._load_file()["users"].get(user_id)
+
+    def append(self, user_id: str, kind: str, record: dict):
+        with self._lock:
+            db = self._load_file()
+            user = db["users"].setdefault(user_id, _empty_user())
+            _add_sorted(user.setdefault(kind, []), [record])
+            self._dump_file(db)
+        return record
+
+    def append_many(self, user_id: str, kind: str, records):
+        with self._lock:
+            db = self._load_file()
+            user = db["users"].setdefault(user_id, _empty_user())
+            _add_sorted(user.setdefault(kind, []), records)
+            self._dump_file(db)
+
+    def ingest(self, rows):
+        with self._lock:
+            db = self._load_file()
+            added = _ingest_into(db, rows)
+            self._dump_file(db)
+        return added
+
+    def user_ids(self):
+        return list(self._load_file()["users"])
+
+    def iter_records(self, user_id: str = None):
+        users = self._load_file()["users"]
+        for uid in [user_id] if user_id is not None else list(users):
+            for kind, records in (users.get(uid) or {}).items():
+                for record in records:
+                    yield uid, kind, record
+
+
+def wal_connection(local: threading.local, path: str):
+    """This thread's connection to the SQLite file at ``path``, opened in WAL mode and kept on ``local``.
+
+    Connections are never shared between threads; every SQLite-backed class
+    (vault, jobs, caches, search index) gets its connections here.
+    """
+    conn = getattr(local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        local.conn = conn
+    return conn
+
+
+@contextmanager
+def _file_lock(lock_path: str):
+    """Exclusive lock shared by every process (gunicorn worker) using the same vault."""
+    with open(lock_path, "a") as fh:
+        if fcntl is not None:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+class _Batch:
+    def __init__(self):
+        self.ops = []  # callables applied in order to the in-memory vault
+        self.done = threading.Event()
+        self.error = None
+
+
+class CachedJsonStore(JsonStore):
+    """JSON vault with an in-memory copy and group-committed, write-behind flushes.
+
+    Reads are served from memory as long as the file on disk still has the
+    signature (mtime/size/inode) we last saw; another worker's flush changes it
+    and triggers a reload. Appends arriving within ``commit_window`` seconds are
+    applied and written in a single flush under an inter-process file lock, so
+    concurrent requests neither lose each other's updates nor each pay for a
+    full rewrite. ``append`` returns once its batch is on disk.
+    """
+
+    def __init__(self, path: str, commit_window: float = 0.005, max_batch: int = 256):
+        super().__init__(path)
+        self.lock_path = f"{path}.lock"
+        self.commit_window = commit_window
+        self.max_batch = max_batch
+        self._mem_lock = threading.Lock()
+        self._data = None
+        self._sig = None
+        self._cond = threading.Condition()
+        self._batch = None
+        # the flusher starts on first write, and again in a forked child (e.g. gunicorn
+        # --preload), which inherits this object but not the parent's thread
+        self._flusher_pid = None
+        self._start_lock = threading.Lock()
+
+    def _signature(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _current(self):
+        """Return the cached vault, reloading it if the file changed underneath us."""
+        sig = self._signature()
+        with self._mem_lock:
+            if self._data is None or sig != self._sig:
+                self._data = self._load_file()
+                self._sig = sig
+            return self._data
+
+    def get_user(self, user_id: str):
+        data = self._current()
+        with self._mem_lock:
+            user = data["users"].get(user_id)
+            if user is None:
+                return None
+            return {kind: list(records) for kind, records in user.items()}
+
+    def list_records(self, user_id: str, kind: str):
+        data = self._current()
+        with self._mem_lock:
+            user = data["users"].get(user_id) or {}
+            return list(user.get(kind, []))
+
+    def user_ids(self):
+        data = self._current()
+        with self._mem_lock:
+            return list(data["users"])
+
+    # one user's records copied at a time, rather than JsonStore's full read
+    iter_records = VaultStore.iter_records
+
+    def page(self, user_id: str, kind: str, limit: int, before=None, since: str = None):
+        data = self._current()
+        with self._mem_lock:
+            user = data["users"].get(user_id) or {}
+            return _page_newest_first(user.get(kind, []), limit, before, since)
+
+    def user_version(self, user_id: str):
+        data = self._current()
+        with self._mem_lock:
+            user = data["users"].get(user_id) or {}
+            return "|".join(
+                f"{kind}:{len(records)}:{records[-1]['id'] if records else ''}" for kind, records in sorted(user.items())
+            )
+
+    def append(self, user_id: str, kind: str, record: dict):
+        self.append_many(user_id, kind, [record])
+        return record
+
+    def append_many(self, user_id: str, kind: str, records):
+        records = list(records)
+
+        def op(data):
+            user = data["users"].setdefault(user_id, _empty_user())
+            _add_sorted(user.setdefault(kind, []), records)
+
+        self._submit(op)
+
+    def ingest(self, rows):
+        # read/decode the rows here rather than on the flusher under _mem_lock, and
+        # commit them on their own so a failed import never fails appends batched with it
+        rows = list(rows)
+        result = {}
+
+        def op(data):
+            result["added"] = _ingest_into(data, rows)
+
+        try:
+            self._flush([op])
+        except Exception:
+            with self._mem_lock:
+                self._sig = None  # memory may be ahead of disk; reload on next read
+            raise
+        return result["added"]
+
+    def _ensure_flusher(self):
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        with self._start_lock:
+            if self._flusher_pid == pid:
+                return
+            if self._flusher_pid is not None:
+                # forked: locks held by the parent's threads stay held here, and its
+                # pending batch belongs to writers that do not exist in this process
+                self._mem_lock = threading.Lock()
+                self._cond = threading.Condition()
+                self._batch = None
+            threading.Thread(target=self._flush_loop, name="vault-flusher", daemon=True).start()
+            self._flusher_pid = pid
+
+    def _submit(self, op):
+        self._ensure_flusher()
+        with self._cond:
+            if self._batch is None:
+                self._batch = _Batch()
+            batch = self._batch
+            batch.ops.append(op)
+            self._cond.notify_all()
+        batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._batch is not None)
+                # group commit: give concurrent writers a moment to join this batch
+                self._cond.wait_for(lambda: len(self._batch.ops) >= self.max_batch, timeout=self.commit_window)
+                batch, self._batch = self._batch, None
+            try:
+                self._flush(batch.ops)
+            except Exception as e:
+                batch.error = e
+                with self._mem_lock:
+                    self._sig = None  # memory may be ahead of disk; reload on next read
+            batch.done.set()
+
+    def _flush(self, ops):
+        with _file_lock(self.lock_path):
+            data = self._current()
+            with self._mem_lock:
+                for op in ops:
+                    op(data)
+                self._dump_file(data)
+                self._sig = self._signature()
+
+
+class SqliteStore(VaultStore):
+    """SQLite (WAL) backend: one row per record, indexed by (user_id, kind, timestamp).
+
+    Inserting an entry or reading one user's vault only touches that user's rows.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS records (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        id TEXT NOT NULL UNIQUE,
+        user_id TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_records_user_kind_ts ON records (user_id, kind, timestamp);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+
+    def _conn(self):
+        return wal_connection(self._local, self.path)
+
+    def get_user(self, user_id: str):
+        rows = self._conn().execute(
+            "SELECT kind, data FROM records WHERE user_id = ? ORDER BY timestamp, seq",
+            (user_id,),
+        ).fetchall()
+        if not rows:
+            return None
+        user = _empty_user()
+        for kind, data in rows:
+            user.setdefault(kind, []).append(json.loads(data))
+        return user
+
+    def list_records(self, user_id: str, kind: str):
+        rows = self._conn().execute(
+            "SELECT data FROM records WHERE user_id = ? AND kind = ? ORDER BY timestamp, seq",
+            (user_id, kind),
+        ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def page(self, user_id: str, kind: str, limit: int, before=None, since: str = None):
+        sql = "SELECT data FROM records WHERE user_id = ? AND kind = ?"
+        args = [user_id, kind]
+        if before is not None:
+            sql += " AND (timestamp, id) < (?, ?)"
+            args += list(before)
+        if since is not None:
+            sql += " AND timestamp > ?"
+            args.append(since)
+        sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+        args.append(limit)
+        return [json.loads(data) for (data,) in self._conn().execute(sql, args).fetchall()]
+
+    def user_version(self, user_id: str):
+        count, last = self._conn().execute(
+            "SELECT COUNT(*), MAX(seq) FROM records WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return f"{count}:{last or 0}"
+
+    def append(self, user_id: str, kind: str, record: dict):
+        self.append_many(user_id, kind, [record])
+        return record
+
+    def append_many(self, user_id: str, kind: str, records):
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO records (id, user_id, kind, timestamp, data) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (r["id"], user_id, kind, r.get("timestamp", ""), json.dumps(r, ensure_ascii=False))
+                    for r in records
+                ],
+            )
+
+    def ingest(self, rows):
+        conn = self._conn()
+        before = conn.total_changes
+        with conn:
+            # executemany consumes the generator row by row, so nothing is buffered here
+            conn.executemany(
+                "INSERT OR IGNORE INTO records (id, user_id, kind, timestamp, data) VALUES (?, ?, ?, ?, ?)",
+                (
+                    (r["id"], user_id, kind, r.get("timestamp", ""), json.dumps(r, ensure_ascii=False))
+                    for user_id, kind, r in rows
+                ),
+            )
+        return conn.total_changes - before
+
+    def user_ids(self):
+        return [uid for (uid,) in self._conn().execute("SELECT DISTINCT user_id FROM records ORDER BY user_id")]
+
+    def iter_records(self, user_id: str = None, batch_size: int = 500):
+        # keyset pagination: each batch is its own short query, so the export
+        # never holds a cursor (or the whole table) across yields
+        where = "WHERE user_id = ?" if user_id is not None else ""
+        position = None
+        while True:
+            sql = "SELECT user_id, kind, timestamp, seq, data FROM records " + where
+            args = [user_id] if user_id is not None else []
+            if position is not None:
+                sql += (" AND " if where else " WHERE ") + "(user_id, kind, timestamp, seq) > (?, ?, ?, ?)"
+                args += position
+            sql += " ORDER BY user_id, kind, timestamp, seq LIMIT ?"
+            args.append(batch_size)
+            rows = self._conn().execute(sql, args).fetchall()
+            for uid, kind, _, _, data in rows:
+                yield uid, kind, json.loads(data)
+            if len(rows) < batch_size:
+                return
+            position = list(rows[-1][:4])
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# -----------------------
+# Migration / factory
+# -----------------------
+def _remove_sqlite_files(path: str):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def migrate_json_to_sqlite(json_path: str, sqlite_path: str):
+    """One-shot copy of the JSON vault into a new SQLite file. Returns the number of records copied.
+
+    The copy is built in a temp file in one transaction and renamed into place,
+    so ``sqlite_path`` either doesn't exist or holds the complete vault. Only
+    one process migrates at a time; the others get FileExistsError once it is done.
+    """
+    with _file_lock(f"{sqlite_path}.lock"):
+        if os.path.exists(sqlite_path):
+            raise FileExistsError(f"{sqlite_path} already exists")
+        for stale in glob.glob(glob.escape(sqlite_path) + ".*.migrating"):
+            _remove_sqlite_files(stale)  # debris of a crashed attempt
+        return _migrate_into(json_path, sqlite_path)
+
+
+def _migrate_into(json_path: str, sqlite_path: str):
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    tmp = f"{sqlite_path}.{os.getpid()}.migrating"
+    store = SqliteStore(tmp)
+    try:
+        count = store.ingest(
+            (user_id, kind, record)
+            for user_id, user in data.get("users", {}).items()
+            for kind, records in user.items()
+            for record in records
+        )
+    except BaseException:
+        store.close()
+        _remove_sqlite_files(tmp)
+        raise
+    store.close()  # last connection: checkpoints the WAL back into the file
+    os.replace(tmp, sqlite_path)
+    return count
+
+
+def open_store(backend: str, json_path: str, sqlite_path: str, commit_window: float = 0.005):
+    if backend == "sqlite":
+        if not os.path.exists(sqlite_path) and os.path.exists(json_path):
+            try:
+                copied = migrate_json_to_sqlite(json_path, sqlite_path)
+                print(f"Migrated {copied} records from {json_path} to {sqlite_path}")
+            except FileExistsError:
+                pass  # another worker starting at the same time did it
+        return SqliteStore(sqlite_path)
+    if backend == "cached":
+        return CachedJsonStore(json_path, commit_window=commit_window)
+    if backend == "json":
+        return JsonStore(json_path)
+    raise ValueError(f"Unknown vault store backend: {backend!r}")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 4 or sys.argv[1] != "migrate":
+        print("usage: python storage.py migrate <hope_vault_db.json> <hope_vault.sqlite3>")
+        sys.exit(2)
+    print(f"Migrated {migrate_json_to_sqlite(sys.argv[2], sys.argv[3])} records")
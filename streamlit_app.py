@@ -1,9 +1,11 @@
 import streamlit as st
-import requests
-from urllib.parse import urljoin
+import json as _json
+import time
+from urllib.parse import urljoin, urlencode
 from datetime import datetime, timedelta
 import pytz
-from streamlit_autorefresh import st_autorefresh
+import requests
+from requests.adapters import HTTPAdapter
 
 # ========= Config & Page setup =========
 API_BASE_DEFAULT = "http://127.0.0.1:8000/api"
@@ -22,20 +24,113 @@ LANGUAGES = {
 }
 
 
-def api_get(path, params=None):
+VAULT_CACHE_TTL = 60  # seconds; also cleared after saving a memory or generating a story
+VAULT_PAGE_SIZE = 20  # memories per "Show older memories" click
+PROMPT_CACHE_TTL = 3600
+
+
+@st.cache_resource
+def http_session():
+    # one keep-alive connection pool for every rerun, tab and user of this app
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _api_url(base, path):
+    return urljoin(base + "/", path.lstrip("/"))
+
+
+def api_post(path, json=None, files=None):
     try:
-        r = requests.get(urljoin(API_BASE + "/", path.lstrip("/")), params=params, timeout=20)
+        r = http_session().post(_api_url(API_BASE, path), json=json, files=files, timeout=60)
         return r.json()
     except Exception as e:
         return {"error": str(e)}
 
 
-def api_post(path, json=None, files=None):
+@st.cache_resource
+def _vault_validators():
+    # (base, user_id, cursor) -> (ETag, page): lets an expired or cleared page be
+    # revalidated with If-None-Match instead of downloaded again
+    return {}
+
+
+# Cached reads: a rerun (any widget click) reuses the last answer instead of asking the
+# backend again. Failures raise, so they are never cached.
+@st.cache_data(ttl=VAULT_CACHE_TTL, show_spinner=False)
+def _fetch_vault_page(base, user_id, cursor):
+    validators = _vault_validators()
+    key = (base, user_id, cursor)
+    known = validators.get(key)
+    params = {'user_id': user_id, 'limit': VAULT_PAGE_SIZE}
+    if cursor:
+        params['cursor'] = cursor
+    headers = {'If-None-Match': known[0]} if known else {}
+    r = http_session().get(_api_url(base, 'vault'), params=params, headers=headers, timeout=20)
+    if r.status_code == 304 and known:
+        return known[1]
+    r.raise_for_status()
+    page = r.json()
+    if r.headers.get('ETag'):
+        if len(validators) > 256:
+            validators.clear()
+        validators[key] = (r.headers['ETag'], page)
+    return page
+
+
+@st.cache_data(ttl=PROMPT_CACHE_TTL, show_spinner=False)
+def _fetch_prompt(base, lang):
+    r = http_session().get(_api_url(base, 'prompt'), params={'lang': lang}, timeout=20)
+    r.raise_for_status()
+    return r.json()
+
+
+def get_vault(user_id, pages=1):
+    """The newest ``pages`` pages of memories: {"entries": [...newest first], "more": bool}."""
+    entries, cursor = [], None
     try:
-        r = requests.post(urljoin(API_BASE + "/", path.lstrip("/")), json=json, files=files, timeout=60)
-        return r.json()
+        for _ in range(pages):
+            page = _fetch_vault_page(API_BASE, user_id, cursor)
+            entries.extend(page.get('entries', []))
+            cursor = page.get('next_cursor')
+            if not cursor:
+                break
     except Exception as e:
         return {"error": str(e)}
+    return {"entries": entries, "more": bool(cursor)}
+
+
+def get_prompt(lang='en'):
+    try:
+        return _fetch_prompt(API_BASE, lang)
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def invalidate_api_cache():
+    _fetch_vault_page.clear()
+    _fetch_prompt.clear()
+
+
+def api_stream(path, json=None):
+    """POST to a server-sent-events endpoint and yield (event, data) pairs as they arrive."""
+    try:
+        with http_session().post(_api_url(API_BASE, path), json=json, stream=True, timeout=120) as r:
+            if not r.headers.get('content-type', '').startswith('text/event-stream'):
+                yield 'error', r.json()
+                return
+            event = 'message'
+            for line in r.iter_lines(decode_unicode=True):
+                if line.startswith('event:'):
+                    event = line[len('event:'):].strip()
+                elif line.startswith('data:'):
+                    yield event, _json.loads(line[len('data:'):].strip())
+                    event = 'message'
+    except Exception as e:
+        yield 'error', {"error": str(e)}
 
 # ======= Styling (MAANG-inspired clean theme) =======
 st.markdown(
@@ -80,13 +175,29 @@ st.markdown(
 col_h1, col_h2 = st.columns([4,1])
 with col_h1:
     st.markdown('<div class="hero card"><div><div class="title">Hope Vault</div><div class="subtitle">AI-powered memory vault → story → audio — gentle, private & wholesome</div></div></div>', unsafe_allow_html=True)
-with col_h2:
-    # Live Kolkata Clock (small)
-    st_autorefresh(interval=1000, limit=None, key='header_clock')
+
+
+# Live Kolkata Clock (small). A fragment reruns on its own every second, so
+# ticking the clock doesn't re-execute the page (and its backend calls).
+@st.fragment(run_every=1)
+def header_clock():
     tz = pytz.timezone('Asia/Kolkata')
     st.caption('Local time (Kolkata)')
     st.markdown(f"<div style='font-weight:700;font-size:14px'>{datetime.now(tz).strftime('%Y-%m-%d %H:%M:%S')}</div>", unsafe_allow_html=True)
 
+    # ======= Reminder (30-min) =======
+    # checked here so it still fires while the page sits idle
+    if 'last_notification' not in st.session_state:
+        st.session_state['last_notification'] = datetime.now()
+    if datetime.now() - st.session_state['last_notification'] >= timedelta(minutes=30):
+        st.balloons()
+        st.info('💡 Take a moment to write something inspiring in your Hope Vault!')
+        st.session_state['last_notification'] = datetime.now()
+
+
+with col_h2:
+    header_clock()
+
 st.markdown("---")
 
 # ======= Slideshow =======
@@ -102,41 +213,43 @@ captions = [
     "Mountains — stillness within",
 ]
 
-if 'slide_idx' not in st.session_state:
-    st.session_state['slide_idx'] = 0
-if 'slide_autorefresh_prev' not in st.session_state:
-    st.session_state['slide_autorefresh_prev'] = None
-
-# Auto-rotate control
-auto_rotate = st.checkbox('Auto-rotate slides', value=True, key='auto_rotate_slides')
-
-# If auto-rotate enabled, use st_autorefresh to tick every 5 seconds
-if auto_rotate:
-    slideshow_tick = st_autorefresh(interval=5000, limit=None, key='slideshow_autorefresh')
-    # when tick increments, advance slide index once
-    if st.session_state.get('slide_autorefresh_prev') is None:
-        st.session_state['slide_autorefresh_prev'] = slideshow_tick
-    elif slideshow_tick != st.session_state['slide_autorefresh_prev']:
-        st.session_state['slide_idx'] = (st.session_state.get('slide_idx', 0) + 1) % len(slides)
-        st.session_state['slide_autorefresh_prev'] = slideshow_tick
-
-# Render slideshow with manual controls
-l, m, r = st.columns([1,8,1])
-with l:
-    if st.button('◀'):
-        st.session_state['slide_idx'] = (st.session_state['slide_idx'] - 1) % len(slides)
-        # reset autorefresh counter to avoid immediate auto-advance
-        st.session_state['slide_autorefresh_prev'] = None
-with m:
-    idx = st.session_state['slide_idx']
-    st.markdown('<div class="card">', unsafe_allow_html=True)
-    st.image(slides[idx], use_container_width=True)
-    st.markdown(f"<div class='slide-caption' style='padding:8px 6px'>{captions[idx]}</div>", unsafe_allow_html=True)
-    st.markdown('</div>', unsafe_allow_html=True)
-with r:
-    if st.button('▶'):
+SLIDE_SECONDS = 5
+
+
+# Like the clock, the slideshow is a fragment: its timer and arrow buttons only rerun this block.
+@st.fragment(run_every=SLIDE_SECONDS)
+def slideshow():
+    if 'slide_idx' not in st.session_state:
+        st.session_state['slide_idx'] = 0
+    now = time.monotonic()
+    if 'slide_changed_at' not in st.session_state:
+        st.session_state['slide_changed_at'] = now
+
+    # Auto-rotate control
+    auto_rotate = st.checkbox('Auto-rotate slides', value=True, key='auto_rotate_slides')
+
+    # Render slideshow with manual controls
+    l, m, r = st.columns([1,8,1])
+    with l:
+        back = st.button('◀')
+    with r:
+        forward = st.button('▶')
+    if back or forward:
+        st.session_state['slide_idx'] = (st.session_state['slide_idx'] + (1 if forward else -1)) % len(slides)
+        # restart the timer so a click isn't followed by an immediate auto-advance
+        st.session_state['slide_changed_at'] = now
+    elif auto_rotate and now - st.session_state['slide_changed_at'] >= SLIDE_SECONDS - 0.5:
         st.session_state['slide_idx'] = (st.session_state['slide_idx'] + 1) % len(slides)
-        st.session_state['slide_autorefresh_prev'] = None
+        st.session_state['slide_changed_at'] = now
+    with m:
+        idx = st.session_state['slide_idx']
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        st.image(slides[idx], use_container_width=True)
+        st.markdown(f"<div class='slide-caption' style='padding:8px 6px'>{captions[idx]}</div>", unsafe_allow_html=True)
+        st.markdown('</div>', unsafe_allow_html=True)
+
+
+slideshow()
 
 st.markdown('---')
 
@@ -149,7 +262,7 @@ with tab1:
     with st.form('add_memory'):
         st.header('Add a memory (daily prompt)')
         with st.expander('Get a prompt from backend'):
-            prompt_resp = api_get('prompt', params={'lang': 'en'})
+            prompt_resp = get_prompt('en')
             if 'prompt' in prompt_resp:
                 st.info(prompt_resp['prompt'])
             else:
@@ -164,6 +277,7 @@ with tab1:
                 payload = {'user_id': USER_ID, 'text': text.strip(), 'language': lang}
                 res = api_post('entry', json=payload)
                 if res.get('status') == 'saved':
+                    invalidate_api_cache()
                     st.success('Memory saved ✅')
                 else:
                     st.error(f"Save failed: {res}")
@@ -174,8 +288,11 @@ with tab2:
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.header('Your Hope Vault')
     if st.button('Refresh vault'):
-        pass
-    vault = api_get('vault', params={'user_id': USER_ID})
+        invalidate_api_cache()
+    if st.session_state.get('vault_user') != USER_ID:
+        st.session_state['vault_user'] = USER_ID
+        st.session_state['vault_pages'] = 1
+    vault = get_vault(USER_ID, st.session_state['vault_pages'])
     if vault.get('entries') is None:
         st.error('Unable to fetch vault. Is backend running and CORS allowed?')
     else:
@@ -184,10 +301,13 @@ with tab2:
             st.info('No memories yet. Add one in the Add Memory tab.')
         else:
             st.markdown('<div class="entries">', unsafe_allow_html=True)
-            for e in entries[::-1]:
+            for e in entries:
                 ts = e.get('timestamp','')[:19]
                 st.markdown(f"**{ts}** — {e.get('text')}")
             st.markdown('</div>', unsafe_allow_html=True)
+            if vault.get('more') and st.button('Show older memories'):
+                st.session_state['vault_pages'] += 1
+                st.rerun()
 
     st.markdown('---')
     st.header('Generate uplifting story')
@@ -196,22 +316,28 @@ with tab2:
         gen_lang = st.selectbox('Story language', options=list(LANGUAGES.keys()), format_func=lambda x: LANGUAGES[x])
         max_len = st.slider('Max length (tokens)', min_value=80, max_value=400, value=200)
         if st.form_submit_button('Generate story'):
-            with st.spinner('Generating story...'):
-                payload = {'user_id': USER_ID, 'theme': theme, 'language': gen_lang, 'max_length': max_len}
-                res = api_post('generate_story', json=payload)
-                if res.get('error'):
-                    st.error('Generation failed: ' + str(res.get('error')))
-                    st.write(res)
-                else:
-                    story = res.get('story', {}).get('text') or (res.get('story') and res['story'].get('text'))
-                    if not story:
-                        story = res.get('story') if isinstance(res.get('story'), str) else None
-                    if story:
-                        st.success('Story generated ✅')
-                        st.text_area('Generated Story (editable)', value=story, height=260, key='generated_story_text')
-                    else:
-                        st.error('No story text found in response. Response:')
-                        st.write(res)
+            payload = {'user_id': USER_ID, 'theme': theme, 'language': gen_lang, 'max_length': max_len}
+            live = st.empty()
+            story, failure = '', None
+            # tokens are rendered as they stream in; the final event carries the saved record
+            for event, data in api_stream('generate_story/stream', json=payload):
+                if event == 'token':
+                    story += data.get('text', '')
+                    live.markdown(story + ' ▌')
+                elif event == 'done':
+                    story = (data.get('story') or {}).get('text') or story
+                    invalidate_api_cache()
+                elif event == 'error':
+                    failure = data
+            live.empty()
+            if failure:
+                st.error('Generation failed: ' + str(failure.get('error') if isinstance(failure, dict) else failure))
+                st.write(failure)
+            if story:
+                st.success('Story generated ✅')
+                st.text_area('Generated Story (editable)', value=story, height=260, key='generated_story_text')
+            elif not failure:
+                st.error('No story text received from backend.')
     st.markdown('</div>', unsafe_allow_html=True)
 
 # ---- Tab 3: Translate & TTS ----
@@ -242,9 +368,15 @@ with tab3:
     tts_lang = st.selectbox('TTS language', options=list(LANGUAGES.keys()), format_func=lambda x: LANGUAGES[x])
     tts_text = st.text_area('Text to speak (edit or paste story here)', value=st.session_state.get('translated_text') or st.session_state.get('generated_story_text',''), height=200, key='tts_text')
     slow = st.checkbox('Slow voice', value=False)
+    stream_audio = st.checkbox('Stream audio (starts playing before the whole story is synthesized)', value=True)
     if st.button('Generate audio'):
         if not tts_text.strip():
             st.warning('Provide text to convert to speech.')
+        elif stream_audio:
+            # the browser pulls the mp3 straight from the backend while chunks are still being synthesized
+            query = urlencode({'text': tts_text, 'language': tts_lang, 'slow': str(slow).lower()})
+            st.audio(urljoin(API_BASE + "/", 'text_to_speech/stream') + '?' + query, format='audio/mpeg')
+            st.caption('Streaming audio — the full file is also saved on the backend for replay.')
         else:
             with st.spinner('Generating audio...'):
                 res = api_post('text_to_speech', json={'text': tts_text, 'language': tts_lang, 'slow': slow})
@@ -259,12 +391,3 @@ with tab3:
                     except Exception:
                         st.info('If stream fails, open the public URL in a new tab to play the file.')
     st.markdown('</div>', unsafe_allow_html=True)
-
-# ======= Reminder (30-min) =======
-if 'last_notification' not in st.session_state:
-    st.session_state['last_notification'] = datetime.now()
-
-if datetime.now() - st.session_state['last_notification'] >= timedelta(minutes=30):
-    st.balloons()
-    st.info('💡 Take a moment to write something inspiring in your Hope Vault!')
-    st.session_state['last_notification'] = datetime.now()
@@ -0,0 +1,170 @@
+import contextvars
+import functools
+import hashlib
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import outbound
+
+# -----------------------
+# Cached, segmented LibreTranslate client
+# -----------------------
+# Text is split into paragraphs (and long paragraphs into sentences). Each
+# segment is looked up in a memory LRU, then in the on-disk cache, keyed on
+# (normalized segment, target_lang); only the misses go to LibreTranslate, in
+# parallel over one keep-alive session. Editing one paragraph of a story only
+# re-translates that paragraph. Each LibreTranslate URL is an outbound.Upstream;
+# with fallback URLs configured, a segment the primary is slow to (or fails to)
+# translate is also requested from the next URL and the first answer wins.
+
+_PARAGRAPH_SPLIT = re.compile(r"(\n\s*\n)")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?।])(\s+)")
+
+
+def split_segments(text: str, max_chars: int = 600):
+    """Split into [(segment, separator_after), ...] such that joining them gives back ``text``."""
+    parts = []
+    pieces = _PARAGRAPH_SPLIT.split(text)
+    for i in range(0, len(pieces), 2):
+        para = pieces[i]
+        sep = pieces[i + 1] if i + 1 < len(pieces) else ""
+        if len(para) <= max_chars:
+            parts.append((para, sep))
+            continue
+        sentences = _SENTENCE_SPLIT.split(para)
+        for j in range(0, len(sentences), 2):
+            inner = sentences[j + 1] if j + 1 < len(sentences) else sep
+            parts.append((sentences[j], inner))
+    return parts
+
+
+def _normalize(text: str):
+    return " ".join(text.split())
+
+
+def _upstream_fault(exc):
+    """A 4xx answer (unsupported language, bad input) says nothing about the server being down; 429 does."""
+    response = getattr(exc, "response", None)
+    return response is None or response.status_code >= 500 or response.status_code == 429
+
+
+class Translator:
+    def __init__(self, url: str, session, memory_cache, disk_cache=None, max_workers: int = 4, timeout: float = 15,
+                 fallback_urls=(), hedge_after: float = 0.5, max_concurrency: int = 8, failure_threshold: int = 5,
+                 reset_timeout: float = 30):
+        self.url = url
+        self.urls = [url, *fallback_urls]
+        self.session = session
+        self.memory = memory_cache
+        self.disk = disk_cache
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.upstreams = [
+            outbound.upstream(
+                f"libretranslate:{urlsplit(u).netloc}", max_concurrency=max_concurrency, timeout=timeout,
+                failure_threshold=failure_threshold, reset_timeout=reset_timeout, is_failure=_upstream_fault,
+            )
+            for u in self.urls
+        ]
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="translate")
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "segments": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "upstream_seconds": 0.0,
+        }
+
+    def _key(self, segment: str, target_lang: str):
+        digest = hashlib.sha256(_normalize(segment).encode("utf-8")).hexdigest()
+        return f"{target_lang}:{digest}"
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for name, delta in deltas.items():
+                self._stats[name] += delta
+
+    def _lookup(self, key: str):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count(memory_hits=1)
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+                self._count(disk_hits=1)
+                return value
+        return None
+
+    def _post(self, url: str, segment: str, target_lang: str, timeout: float):
+        resp = self.session.post(
+            url,
+            data={"q": segment, "source": "auto", "target": target_lang, "format": "text"},
+            timeout=timeout,
+        )
+        resp.raise_for_status()
+        return resp.json().get("translatedText")
+
+    def _fetch(self, segment: str, target_lang: str):
+        t0 = time.monotonic()
+        attempts = [
+            functools.partial(upstream.call, functools.partial(self._post, url, segment, target_lang))
+            for url, upstream in zip(self.urls, self.upstreams)
+        ]
+        translated = outbound.hedged(attempts, self.hedge_after)
+        self._count(misses=1, upstream_seconds=time.monotonic() - t0)
+        return translated
+
+    def translate(self, text: str, target_lang: str):
+        segments = split_segments(text)
+        out = [None] * len(segments)
+        pending = {}  # key -> (segment, [indexes]) so duplicates are fetched once
+        for i, (segment, _) in enumerate(segments):
+            if not segment.strip():
+                out[i] = segment
+                continue
+            self._count(segments=1)
+            key = self._key(segment, target_lang)
+            cached = self._lookup(key)
+            if cached is not None:
+                out[i] = cached
+            else:
+                pending.setdefault(key, (segment, []))[1].append(i)
+
+        # copy_context keeps the calling request's metrics spans attached to the pooled fetches
+        futures = {
+            key: self._pool.submit(contextvars.copy_context().run, self._fetch, seg.strip(), target_lang)
+            for key, (seg, _) in pending.items()
+        }
+        for key, future in futures.items():
+            translated = future.result()
+            if translated is None:
+                raise ValueError("LibreTranslate response had no translatedText")
+            self.memory.set(key, translated)
+            if self.disk is not None:
+                self.disk.set(key, translated)
+            for i in pending[key][1]:
+                out[i] = translated
+        return "".join(part + sep for part, (_, sep) in zip(out, segments))
+
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+        hits = s["memory_hits"] + s["disk_hits"]
+        lookups = hits + s["misses"]
+        avg_upstream = s["upstream_seconds"] / s["misses"] if s["misses"] else 0.0
+        s["hit_ratio"] = round(hits / lookups, 4) if lookups else 0.0
+        s["avg_upstream_seconds"] = round(avg_upstream, 4)
+        # every hit is an upstream round trip we did not make
+        s["saved_seconds_estimate"] = round(hits * avg_upstream, 3)
+        s["upstream_seconds"] = round(s["upstream_seconds"], 3)
+        s["upstreams"] = {u.name: u.status() for u in self.upstreams}
+        s["memory"] = self.memory.stats()
+        if self.disk is not None:
+            s["disk"] = self.disk.stats()
+        return s
@@ -0,0 +1,207 @@
+import contextvars
+import hashlib
+import os
+import re
+import textwrap
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# -----------------------
+# Content-addressed TTS audio cache
+# -----------------------
+# Audio files are named by a hash of (text, language, slow), so repeating a
+# request returns the file that is already on disk. Concurrent identical
+# requests share one synthesis (single-flight), and the directory is kept
+# under a byte budget by deleting the least recently accessed mp3 files.
+
+
+def audio_key(text: str, language: str, slow: bool):
+    raw = f"{language}\0{int(bool(slow))}\0{text.strip()}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:40]
+
+
+_SENTENCE_END = re.compile(r"(?<=[.!?।;])\s+")
+
+
+def split_sentences(text: str, max_chars: int = 250):
+    """Split text into sentence chunks, merging short sentences up to ``max_chars``.
+
+    A sentence longer than ``max_chars`` is cut at word boundaries.
+    """
+    chunks = []
+    current = ""
+    for sentence in _SENTENCE_END.split(text.strip()):
+        sentence = sentence.strip()
+        for piece in textwrap.wrap(sentence, max_chars) if len(sentence) > max_chars else [sentence] if sentence else []:
+            if current and len(current) + 1 + len(piece) > max_chars:
+                chunks.append(current)
+                current = piece
+            else:
+                current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class SentenceStream:
+    """Regroup streamed text (e.g. model tokens) into speakable segments as soon as each is complete.
+
+    A segment ends at the first sentence boundary past ``min_chars``, or at a
+    word boundary once ``max_chars`` pile up without one.
+    """
+
+    def __init__(self, min_chars: int = 40, max_chars: int = 250):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.pending = ""
+
+    def feed(self, text: str):
+        """Add text; returns the segments it completed."""
+        self.pending += text
+        segments = []
+        while True:
+            cut = None
+            for m in _SENTENCE_END.finditer(self.pending):
+                if m.start() >= self.min_chars:
+                    cut = (m.start(), m.end())
+                    break
+            if cut is None and len(self.pending) > self.max_chars:
+                space = self.pending.rfind(" ", 0, self.max_chars)
+                cut = (space, space + 1) if space > 0 else (self.max_chars, self.max_chars)
+            if cut is None:
+                return segments
+            segment = self.pending[:cut[0]].strip()
+            self.pending = self.pending[cut[1]:]
+            if segment:
+                segments.append(segment)
+
+    def finish(self):
+        """Flush whatever is left once the text is complete."""
+        rest, self.pending = self.pending.strip(), ""
+        return [rest] if rest else []
+
+
+class AudioCache:
+    def __init__(self, audio_dir: str, max_bytes: int):
+        self.audio_dir = audio_dir
+        self.max_bytes = max_bytes
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+
+    def path_for(self, key: str):
+        return os.path.join(self.audio_dir, f"tts_{key}.mp3")
+
+    def _touch(self, path: str):
+        # record the access so eviction sees it (atime alone is unreliable on noatime mounts)
+        now = time.time()
+        os.utime(path, (now, os.stat(path).st_mtime))
+
+    def get_or_create(self, key: str, synthesize):
+        """Return (path, cached). ``synthesize(tmp_path)`` writes the mp3 on a miss."""
+        path = self.path_for(key)
+        if os.path.exists(path):
+            self._touch(path)
+            return path, True
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+        if not leader:
+            return future.result(), True
+
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            synthesize(tmp)
+            os.replace(tmp, path)
+            future.set_result(path)
+        except Exception as e:
+            future.set_exception(e)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        self.evict()
+        return path, False
+
+    def evict(self):
+        """Delete least recently accessed mp3 files until the directory fits the budget."""
+        with self._evict_lock:
+            files = []
+            total = 0
+            for entry in os.scandir(self.audio_dir):
+                if entry.is_file() and entry.name.endswith(".mp3"):
+                    st = entry.stat()
+                    files.append((st.st_atime, st.st_size, entry.path))
+                    total += st.st_size
+            if total <= self.max_bytes:
+                return
+            for _, size, path in sorted(files):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def stats(self):
+        files = [e for e in os.scandir(self.audio_dir) if e.is_file() and e.name.endswith(".mp3")]
+        return {
+            "files": len(files),
+            "bytes": sum(e.stat().st_size for e in files),
+            "max_bytes": self.max_bytes,
+        }
+
+
+class ChunkedSpeech:
+    """Synthesize sentence chunks concurrently and stream the mp3 bytes in order.
+
+    MP3 frames can simply be concatenated (gTTS does the same for its own
+    internal segments), so each chunk is sent as soon as it and every chunk
+    before it are done. The full file is written into the audio cache under the
+    same content key as a regular synthesis, and later requests stream from it.
+    """
+
+    def __init__(self, cache: AudioCache, max_workers: int = 4, read_size: int = 64 * 1024):
+        self.cache = cache
+        self.read_size = read_size
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts-chunk")
+
+    def stream(self, key: str, text: str, synthesize_bytes):
+        """Yield mp3 bytes; ``synthesize_bytes(chunk_text)`` returns the mp3 for one chunk."""
+        path = self.cache.path_for(key)
+        if os.path.exists(path):
+            self.cache._touch(path)
+            with open(path, "rb") as f:
+                while True:
+                    data = f.read(self.read_size)
+                    if not data:
+                        return
+                    yield data
+
+        futures = [self._pool.submit(contextvars.copy_context().run, synthesize_bytes, chunk) for chunk in split_sentences(text)]
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        complete = False
+        try:
+            with open(tmp, "wb") as out:
+                for future in futures:
+                    data = future.result()
+                    out.write(data)
+                    yield data
+            os.replace(tmp, path)
+            complete = True
+        finally:
+            if not complete:
+                # client went away or a chunk failed: drop queued work and the partial file
+                for future in futures:
+                    future.cancel()
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        self.cache.evict()